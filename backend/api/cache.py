@@ -0,0 +1,107 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from api.metrics import increment
+
+VERSION_KEY = 'version:{}'
+RECIPE_VERSION = 'recipe:{}'
+USER_VERSION = 'user:{}'
+CART_VERSION = 'cart:{}'
+TAGS_VERSION = 'table:tags'
+INGREDIENTS_VERSION = 'table:ingredients'
+POPULARITY_VERSION = 'table:popularity'
+SIMILAR_VERSION = 'table:similar'
+RECIPE_INGREDIENTS_VERSION = 'table:recipe_ingredients'
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_versions(*names):
+    """
+    Возвращает словарь текущих версий по именам. Отсутствующие в кэше версии
+    создаются заново, поэтому устаревшие значения не могут совпасть с ними.
+    """
+    keys = {VERSION_KEY.format(name): name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        version = _new_version()
+        cache.add(key, version, None)
+        versions[key] = cache.get(key, version)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def get_version(name):
+    return get_versions(name)[name]
+
+
+def bump_version(*names):
+    """Меняет версии, делая недействительными все зависящие от них ключи."""
+    cache.set_many(
+        {VERSION_KEY.format(name): _new_version() for name in names}, None
+    )
+
+
+def invalidate(metric_group, *names):
+    """
+    Меняет версии сразу и повторно после фиксации транзакции, чтобы
+    представление, закэшированное до фиксации, не пережило ее. Без
+    `metric_group` сброс не учитывается в метриках.
+    """
+    if not names:
+        return
+    bump_version(*names)
+    transaction.on_commit(lambda: bump_version(*names))
+    if metric_group is not None:
+        increment(metric_group, 'eviction', len(names))
+
+
+def get_or_render_many(keys, render, timeout, metric_group):
+    """
+    Возвращает значения по списку ключей из кэша. Отсутствующие значения
+    вычисляются одним вызовом `render(indexes)` по списку их позиций и
+    сохраняются одним запросом.
+    """
+    cached = cache.get_many(keys)
+    indexes = [index for index, key in enumerate(keys) if key not in cached]
+    missing = {}
+    if indexes:
+        missing = dict(zip(
+            (keys[index] for index in indexes), render(indexes)
+        ))
+        cache.set_many(missing, timeout)
+        cached.update(missing)
+    increment(metric_group, 'hit', len(keys) - len(missing))
+    increment(metric_group, 'miss', len(missing))
+    return [cached[key] for key in keys]
+
+
+def recipe_representation_keys(recipes, base_url):
+    """
+    Ключи кэша общей для всех читателей части представления рецептов.
+    Ключ меняется вместе с датой изменения и версией рецепта, версиями его
+    автора, тегов и ингредиентов: дата изменения из базы учитывает и
+    изменения, сделанные другими процессами (например, варианты картинки).
+    """
+    names = {TAGS_VERSION, INGREDIENTS_VERSION}
+    for recipe in recipes:
+        names.add(RECIPE_VERSION.format(recipe.id))
+        names.add(USER_VERSION.format(recipe.author_id))
+    versions = get_versions(*names)
+    base_url = hashlib.md5(base_url.encode()).hexdigest()
+    return [
+        'recipe-representation:{}:{}:{}:{}:{}:{}:{}'.format(
+            recipe.id,
+            recipe.updated_at.timestamp() if recipe.updated_at else '',
+            versions[RECIPE_VERSION.format(recipe.id)],
+            versions[USER_VERSION.format(recipe.author_id)],
+            versions[TAGS_VERSION],
+            versions[INGREDIENTS_VERSION],
+            base_url,
+        )
+        for recipe in recipes
+    ]
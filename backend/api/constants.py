@@ -8,8 +8,88 @@ MAX_VALUE_COOKING_TIME = 10000
 MIN_VALUE_AMOUNT = 1
 MAX_VALUE_AMOUNT = 100000
 
-SHOPPING_LIST_FILE_CONTENT_TYPE = 'text/plain; charset=utf8'
-SHOPPING_LIST_FILE_NAME = 'shopping_cart.txt'
+SHOPPING_LIST_FILE_NAME = 'shopping_cart.{}'
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+# время жизни закэшированного файла Списка покупок, секунд
+
+COUNT_STRATEGY_EXACT = 'exact'
+COUNT_STRATEGY_CACHED = 'cached'
+COUNT_STRATEGY_ESTIMATED = 'estimated'
+COUNT_CACHE_TIMEOUT = 30
+# время жизни закэшированного числа объектов в выборке, секунд
+COUNT_ESTIMATE_THRESHOLD = 10000
+# при оценке планировщика ниже порога выполняется точный подсчет
+
+INGREDIENT_SEARCH_LIMIT = 50
+# максимальное число ингредиентов в ответе автодополнения
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+# время жизни закэшированного представления рецепта, секунд
+
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24
+# время жизни закэшированного ответа справочника (теги, ингредиенты), секунд
+REFERENCE_CACHE_CONTROL = 'public, max-age=60'
+RECIPE_CACHE_CONTROL = 'no-cache'
+
+FEED_STRATEGY_FAN_IN = 'fan_in'
+FEED_STRATEGY_FAN_OUT = 'fan_out'
+FEED_BATCH_SIZE = 1000
+# число записей ленты, вставляемых одним запросом
+
+POPULARITY_PERIOD_DEFAULT = 'week'
+POPULARITY_FAVORITE_WEIGHT = 2.0
+POPULARITY_SHOPPING_CART_WEIGHT = 1.0
+POPULARITY_WINDOWS = {'day': 60 * 60 * 24, 'week': 60 * 60 * 24 * 7}
+# скользящие окна периодов рейтинга популярности, секунд
+POPULARITY_HALF_LIVES = {'day': 60 * 60 * 6, 'week': 60 * 60 * 24 * 2}
+# период полураспада вклада добавления в оценку популярности, секунд
+POPULARITY_MIN_SCORE = 1e-3
+# рецепты с меньшей оценкой удаляются из рейтинга
+POPULARITY_FULL_REFRESH_INTERVAL = 60 * 60 * 24
+# интервал полного пересчета рейтинга, секунд: инкрементный пересчет не
+# учитывает удаленные добавления
+
+SIMILAR_RECIPES_LIMIT = 6
+# число похожих рецептов в ответе по умолчанию
+SIMILAR_NUM_PERM = 64
+SIMILAR_BANDS = 32
+# MinHash-сигнатура из SIMILAR_NUM_PERM значений делится на SIMILAR_BANDS
+# полос LSH; рецепты, совпавшие хотя бы в одной полосе, — кандидаты
+SIMILAR_SEED = 1729
+SIMILAR_BUILD_CHUNK = 200000
+# число пар рецепт-ингредиент, хэшируемых за один шаг построения индекса
+
+IMAGE_VARIANT_SIZES = {'large': 1280, 'medium': 600, 'small': 300}
+# наибольшая сторона уменьшенных копий картинки рецепта, пикселей
+IMAGE_JPEG_QUALITY = 85
+IMAGE_WEBP_QUALITY = 80
+IMAGE_VARIANTS_DIR = 'recipes/variants/'
+IMAGE_TASK_MAX_ATTEMPTS = 5
+IMAGE_TASK_RETRY_DELAY = 60
+# задержка повторной попытки обработки картинки, секунд (растет с попытками)
+IMAGE_WORKER_SLEEP = 2
+# пауза обработчика картинок при пустой очереди, секунд
+IMAGE_GC_GRACE_PERIOD = 60 * 60 * 24
+# файлы картинок моложе этого срока не удаляются сборщиком, секунд
+IMAGE_GC_PASSES = 16
+# число проходов сборщика: за проход в памяти ссылки на часть каталогов
+
+RECIPE_IMAGE_MAX_SIZE = 20 * 2 ** 20
+# максимальный размер картинки рецепта, байт
+RECIPE_UPLOAD_MAX_SIZE = RECIPE_IMAGE_MAX_SIZE + 2 ** 20
+# максимальный размер multipart-запроса с картинкой рецепта, байт
+BASE64_CHUNK_SIZE = 64 * 1024
+# число символов Base64, декодируемых за один шаг (кратно 4)
+BASE64_HEADER_MAX_LENGTH = 100
+# максимальная длина заголовка data URI перед `;base64,`
+
+BATCH_MAX_SIZE = 100
+# максимальное число id в массовом добавлении и удалении
+
+METRIC_GROUPS = (
+    'pagination_count', 'recipe_representation', 'reference_data',
+    'shopping_list',
+)
+METRIC_EVENTS = ('hit', 'miss', 'estimate', 'eviction', 'not_modified')
 
 
 class ErrorMessage:
@@ -51,6 +131,22 @@ class ErrorMessage:
     RECIPE_NOT_IN_FAVORITES = (
         'Рецепт отсутствует в Избранном и не может быть удален из него'
     )
+    IMAGE_TOO_LARGE = (
+        f'Размер картинки не должен превышать '
+        f'{RECIPE_IMAGE_MAX_SIZE // 2 ** 20} МБ'
+    )
+    IMAGE_BASE64 = 'Картинка должна быть data URI с данными в Base64'
+    MULTIPART_DATA = (
+        'Часть `data` multipart-запроса должна содержать JSON-объект'
+    )
+    BATCH_IDS = (
+        f'Значение `ids` должно быть списком не более {BATCH_MAX_SIZE} чисел'
+    )
+    INGREDIENT_IDS_TYPE = (
+        'Значение `ids` должно быть списком id ингредиентов через запятую'
+    )
+    MISSING_TYPE = 'Значение `missing` должно быть неотрицательным числом'
+    POPULARITY_PERIOD = 'Значение `period` должно быть одним из: {}'
     AUTHOR_NOT_IN_SUBSCRIPTION = (
         'Автор отсутствует в Подписках и не может быть удален из них'
     )
@@ -4,8 +4,10 @@ from django_filters.rest_framework import (
 )
 
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, Recipe, Tag, TagRecipe
+from recipes.search import search_recipes
 
 User = get_user_model()
 
@@ -18,7 +20,24 @@ class RecipeFilter(FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
+    search = CharFilter(method='filter_search')
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Полусоединение по id тегов, найденных по слагам при валидации:
+        рецепт попадает в выборку один раз, сколько бы тегов ни совпало.
+        """
+        tag_ids = [tag.id for tag in value]
+        if not tag_ids:
+            return queryset
+        return queryset.filter(Exists(
+            TagRecipe.objects.filter(recipe=OuterRef('pk'), tag__in=tag_ids)
+        ))
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
     def filter_is_favorited(self, queryset, name, value):
         if not self.request.user.is_authenticated:
@@ -36,7 +55,9 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart', 'author', 'tags')
+        fields = (
+            'is_favorited', 'is_in_shopping_cart', 'author', 'tags', 'search',
+        )
 
 
 class IngredientFilter(FilterSet):
@@ -0,0 +1,199 @@
+import posixpath
+import zlib
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from api.constants import (
+    IMAGE_GC_GRACE_PERIOD, IMAGE_GC_PASSES, IMAGE_JPEG_QUALITY,
+    IMAGE_TASK_MAX_ATTEMPTS, IMAGE_TASK_RETRY_DELAY, IMAGE_VARIANT_SIZES,
+    IMAGE_VARIANTS_DIR, IMAGE_WEBP_QUALITY
+)
+from api.signals import invalidate_recipes
+from recipes.models import ImageTask, Recipe
+
+VARIANT_FORMATS = (
+    ('', 'jpg', 'JPEG', {'quality': IMAGE_JPEG_QUALITY, 'optimize': True,
+                         'progressive': True}),
+    ('_webp', 'webp', 'WEBP', {'quality': IMAGE_WEBP_QUALITY, 'method': 4}),
+)
+VARIANT_NAMES = tuple(
+    f'{size_name}{suffix}'
+    for size_name in IMAGE_VARIANT_SIZES for suffix, *_ in VARIANT_FORMATS
+)
+TASK_ERRORS = (
+    OSError, ValueError, Image.DecompressionBombError, DatabaseError
+)
+
+
+def image_storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def render_variants(source):
+    """
+    Уменьшенные копии картинки для каждого размера IMAGE_VARIANT_SIZES в
+    JPEG и WebP: {имя варианта: (расширение, содержимое)}. Картинка не
+    увеличивается; JPEG декодируется сразу в уменьшенном масштабе.
+    """
+    largest = max(IMAGE_VARIANT_SIZES.values())
+    with Image.open(source) as image:
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        transparent = (
+            'A' in image.getbands() or 'transparency' in image.info
+        )
+        image = image.convert('RGBA' if transparent else 'RGB')
+    variants = {}
+    for size_name, size in IMAGE_VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for suffix, extension, image_format, options in VARIANT_FORMATS:
+            frame = resized
+            if image_format == 'JPEG' and transparent:
+                frame = Image.new('RGB', resized.size, 'white')
+                frame.paste(resized, mask=resized.getchannel('A'))
+            buffer = BytesIO()
+            frame.save(buffer, image_format, **options)
+            variants[f'{size_name}{suffix}'] = (extension, buffer.getvalue())
+    return variants
+
+
+def enqueue_missing():
+    """Ставит в очередь картинки рецептов без вариантов и без задачи."""
+    recipes = Recipe.objects.filter(image_variants={}).exclude(
+        image=''
+    ).exclude(image_tasks__isnull=False)
+    return len(ImageTask.objects.bulk_create(
+        ImageTask(recipe_id=recipe_id, image=image)
+        for recipe_id, image in recipes.values_list('id', 'image').iterator()
+    ))
+
+
+def image_roots():
+    return (Recipe._meta.get_field('image').upload_to, IMAGE_VARIANTS_DIR)
+
+
+def bucket_of(name, roots):
+    """
+    Каталог хранилища, в котором лежит файл: корень и первый подкаталог
+    (префикс хэша); для файлов прямо в корне — пустая строка.
+    """
+    for root in roots:
+        if name.startswith(root):
+            head, _, tail = name[len(root):].partition('/')
+            return root, head if tail else ''
+    return None
+
+
+def referenced_names(buckets, roots):
+    """
+    Имена файлов из выбранных каталогов, на которые ссылаются рецепты.
+    Рецепты читаются потоком, в памяти остаются только нужные ссылки.
+    """
+    names = set()
+    for image, variants in Recipe.objects.values_list(
+        'image', 'image_variants'
+    ).iterator(chunk_size=2000):
+        for name in (image, *(variants or {}).values()):
+            if bucket_of(name, roots) in buckets:
+                names.add(name)
+    return names
+
+
+def garbage_files(passes=IMAGE_GC_PASSES, grace=IMAGE_GC_GRACE_PERIOD):
+    """
+    Файлы картинок и их вариантов, на которые не ссылается ни один рецепт
+    и которые старше `grace` секунд.
+
+    Каталоги хранилища делятся на `passes` групп по хэшу имени; для каждой
+    группы ссылки собираются отдельным проходом по рецептам, поэтому в
+    памяти одновременно только ссылки одной группы и список одного каталога.
+    """
+    storage = image_storage()
+    roots = image_roots()
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    buckets = []
+    for root in roots:
+        try:
+            directories, files = storage.listdir(root)
+        except FileNotFoundError:
+            continue
+        buckets.extend((root, directory) for directory in directories)
+        if files:
+            buckets.append((root, ''))
+    for index in range(passes):
+        group = {
+            bucket for bucket in buckets
+            if zlib.crc32(posixpath.join(*bucket).encode()) % passes == index
+        }
+        if not group:
+            continue
+        referenced = referenced_names(group, roots)
+        for root, directory in sorted(group):
+            path = posixpath.join(root, directory)
+            for filename in storage.listdir(path)[1]:
+                name = posixpath.join(path, filename)
+                if (
+                    name not in referenced
+                    and storage.get_modified_time(name) < cutoff
+                ):
+                    yield name
+
+
+def process_task(task):
+    """
+    Строит варианты картинки задачи и сохраняет пути к ним в рецепте, если
+    картинка рецепта с тех пор не менялась. Варианты хранятся по хэшу
+    содержимого, как и картинки: прежние файлы удаляет команда gc_images.
+    """
+    if not Recipe.objects.filter(
+        pk=task.recipe_id, image=task.image
+    ).exists():
+        return
+    storage = image_storage()
+    with storage.open(task.image) as source:
+        variants = render_variants(source)
+    names = {
+        variant: storage.save(
+            f'{IMAGE_VARIANTS_DIR}{variant}.{extension}', ContentFile(content)
+        )
+        for variant, (extension, content) in variants.items()
+    }
+    if Recipe.objects.filter(pk=task.recipe_id, image=task.image).update(
+        image_variants=names, updated_at=timezone.now()
+    ):
+        invalidate_recipes(task.recipe_id)
+
+
+def process_next():
+    """
+    Выполняет одну готовую задачу очереди. Задача блокируется до конца
+    обработки, а занятые другими обработчиками задачи пропускаются, поэтому
+    обработчиков может быть несколько. Неудачная попытка откладывает
+    задачу с растущей задержкой. Возвращает False, если задач нет.
+    """
+    with transaction.atomic():
+        task = ImageTask.objects.select_for_update(skip_locked=True).filter(
+            run_after__lte=timezone.now(),
+            attempts__lt=IMAGE_TASK_MAX_ATTEMPTS,
+        ).order_by('id').first()
+        if task is None:
+            return False
+        try:
+            with transaction.atomic():
+                process_task(task)
+        except TASK_ERRORS as error:
+            task.attempts += 1
+            task.error = repr(error)
+            task.run_after = timezone.now() + timedelta(
+                seconds=IMAGE_TASK_RETRY_DELAY * 2 ** (task.attempts - 1)
+            )
+            task.save(update_fields=('attempts', 'error', 'run_after'))
+        else:
+            task.delete()
+    return True
@@ -0,0 +1,68 @@
+import threading
+from bisect import bisect_left
+
+from api.cache import INGREDIENTS_VERSION, get_version
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения по названию.
+
+    Индекс строится при первом обращении и перестраивается, когда меняется
+    версия таблицы ингредиентов. Названия хранятся в отсортированном списке,
+    поэтому совпадения по началу названия находятся двоичным поиском.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._keys = ()
+        self._items = ()
+
+    def _build(self, version):
+        rows = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (row['name'].casefold(), row['id']),
+        )
+        self._keys, self._items = (
+            tuple(row['name'].casefold() for row in rows), tuple(rows)
+        )
+        self._version = version
+
+    def _ensure_built(self):
+        version = get_version(INGREDIENTS_VERSION)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build(version)
+        return self._keys, self._items
+
+    def search(self, query, limit):
+        """
+        Ингредиенты, название которых начинается с `query`, затем те, в
+        названии которых `query` встречается, не более `limit` штук.
+        """
+        keys, items = self._ensure_built()
+        query = query.casefold()
+        result = []
+        start = bisect_left(keys, query)
+        position = start
+        while (
+            position < len(keys) and len(result) < limit
+            and keys[position].startswith(query)
+        ):
+            result.append(items[position])
+            position += 1
+        if len(result) < limit and query:
+            for index, key in enumerate(keys):
+                if start <= index < position:
+                    continue
+                if query in key and not key.startswith(query):
+                    result.append(items[index])
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,97 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.constants import FEED_STRATEGY_FAN_IN, FEED_STRATEGY_FAN_OUT
+from recipes.feed import fan_out_recipe, feed_queryset, rebuild_feed
+from recipes.models import Recipe, Subscription
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение стратегий ленты подписок fan_in и fan_out на '
+        'синтетических данных. Все данные откатываются по завершении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=10000)
+        parser.add_argument('--authors', type=int, default=10)
+        parser.add_argument('--recipes', type=int, default=20,
+                            help='Количество рецептов у каждого автора.')
+        parser.add_argument('--samples', type=int, default=100,
+                            help='Количество читаемых лент.')
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Размер страницы ленты.')
+
+    def timed(self, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        return result, (time.perf_counter() - start) * 1000
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        self.stdout.write(
+            f'{name}: среднее {statistics.mean(timings):.2f} мс, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} мс'
+        )
+
+    def create_data(self, options):
+        users = User.objects.bulk_create(
+            User(username=f'feed-bench-{index}',
+                 email=f'feed-bench-{index}@example.com', password='!')
+            for index in range(options['followers'] + options['authors'])
+        )
+        if not users or users[0].pk is None:
+            users = list(User.objects.filter(
+                username__startswith='feed-bench-'
+            ).order_by('id'))
+        authors = users[:options['authors']]
+        followers = users[options['authors']:]
+        Subscription.objects.bulk_create((
+            Subscription(user=follower, author=author)
+            for follower in followers for author in authors
+        ), batch_size=5000)
+        Recipe.objects.bulk_create((
+            Recipe(author=author, name=f'Рецепт {index}', text='Описание',
+                   cooking_time=10, image='recipes/benchmark.jpg')
+            for author in authors for index in range(options['recipes'])
+        ), batch_size=5000)
+        return authors, followers
+
+    def read_feeds(self, followers, strategy, limit):
+        timings = []
+        for follower in followers:
+            _, elapsed = self.timed(lambda: list(feed_queryset(
+                follower, Recipe.objects.all(), strategy
+            ).values_list('id', flat=True)[:limit]))
+            timings.append(elapsed)
+        return timings
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            authors, followers = self.create_data(options)
+            sample = followers[:options['samples']]
+            _, elapsed = self.timed(
+                rebuild_feed, [follower.id for follower in followers]
+            )
+            self.stdout.write(f'Заполнение лент fan_out: {elapsed:.0f} мс')
+            recipe = Recipe.objects.create(
+                author=authors[0], name='Новый рецепт', text='Описание',
+                cooking_time=10, image='recipes/benchmark.jpg',
+            )
+            _, elapsed = self.timed(fan_out_recipe, recipe)
+            self.stdout.write(
+                f'Публикация рецепта для {len(followers)} подписчиков '
+                f'(fan_out): {elapsed:.0f} мс'
+            )
+            for strategy in (FEED_STRATEGY_FAN_IN, FEED_STRATEGY_FAN_OUT):
+                self.report(
+                    f'Чтение ленты ({strategy})',
+                    self.read_feeds(sample, strategy, options['limit'])
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,108 @@
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.similar_index import IndexData, compute_signatures
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер построения индекса похожих рецептов и запросов к нему на '
+        'синтетических наборах ингредиентов в сравнении с полным перебором.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--templates', type=int, default=500,
+                            help='Количество базовых наборов ингредиентов.')
+        parser.add_argument('--size', type=int, default=10,
+                            help='Количество ингредиентов в рецепте.')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--exact-queries', type=int, default=20,
+                            help='Запросов, сравниваемых с перебором.')
+        parser.add_argument('--limit', type=int, default=6)
+
+    def generate(self, options):
+        """
+        Рецепты — базовые наборы, в которых заменено до трети ингредиентов:
+        так в данных есть группы похожих рецептов.
+        """
+        random = np.random.default_rng(0)
+        size = options['size']
+        templates = np.array([
+            random.choice(options['ingredients'], size, replace=False)
+            for _ in range(options['templates'])
+        ])
+        sets = templates[random.integers(
+            0, len(templates), options['recipes']
+        )].copy()
+        replaced = random.random(sets.shape) < 1 / 3
+        sets[replaced] = random.integers(
+            0, options['ingredients'], replaced.sum()
+        )
+        sets = [np.unique(row) for row in sets]
+        offsets = np.cumsum([0] + [len(row) for row in sets[:-1]])
+        return sets, offsets, np.concatenate(sets)
+
+    def timed(self, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        return result, (time.perf_counter() - start) * 1000
+
+    def exact_scores(self, sets, query):
+        query = set(query.tolist())
+        return np.array([
+            len(query & set(row.tolist())) / len(query | set(row.tolist()))
+            for row in sets
+        ])
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        sets, offsets, ingredient_ids = self.generate(options)
+        signatures, elapsed = self.timed(
+            compute_signatures, offsets, ingredient_ids
+        )
+        self.stdout.write(
+            f'Сигнатуры {len(sets)} рецептов: {elapsed:.0f} мс'
+        )
+        ids = np.arange(len(sets), dtype=np.int64)
+        data, elapsed = self.timed(IndexData.from_signatures, ids, signatures)
+        self.stdout.write(f'Корзины LSH: {elapsed:.0f} мс')
+        with tempfile.TemporaryDirectory() as directory:
+            _, elapsed = self.timed(data.save, directory)
+            self.stdout.write(f'Запись на диск: {elapsed:.0f} мс')
+            data, elapsed = self.timed(IndexData.load, directory)
+            self.stdout.write(f'Отображение в память: {elapsed:.1f} мс')
+            queries = np.random.default_rng(1).choice(
+                len(sets), options['queries'], replace=False
+            )
+            timings, results = [], {}
+            for index in queries:
+                (found, scores), elapsed = self.timed(
+                    data.rank, data.signatures[index], (index,)
+                )
+                results[index] = found[np.lexsort((-found, -scores))[:limit]]
+                timings.append(elapsed)
+            timings.sort()
+            self.stdout.write(
+                f'Запрос к индексу: среднее {statistics.mean(timings):.2f} '
+                f'мс, p95 {timings[int(len(timings) * 0.95) - 1]:.2f} мс'
+            )
+            timings, quality = [], []
+            for index in queries[:options['exact_queries']]:
+                scores, elapsed = self.timed(
+                    self.exact_scores, sets, sets[index]
+                )
+                timings.append(elapsed)
+                scores[index] = -1
+                best = np.sort(scores)[::-1][:limit].sum()
+                quality.append(scores[results[index]].sum() / best)
+            self.stdout.write(
+                f'Полный перебор: среднее {statistics.mean(timings):.0f} мс; '
+                f'сходство найденных индексом рецептов — '
+                f'{statistics.mean(quality):.0%} от лучших'
+            )
@@ -0,0 +1,117 @@
+import base64
+import json
+import math
+import os
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.serializers import decode_base64_image
+from api.views import RecipeViewSet
+from recipes.models import Ingredient, Tag
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер пиковой памяти (tracemalloc) при загрузке картинки рецепта '
+        'в JSON (Base64) и в multipart-запросе. Учитываются только '
+        'выделения Python; данные откатываются по завершении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=float, default=5,
+                            help='Размер картинки, МБ.')
+
+    def make_image(self, size):
+        """PNG из случайного шума: сжимается плохо, размер близок к size."""
+        side = int(math.sqrt(size / 3))
+        image = Image.frombytes('RGB', (side, side), os.urandom(side ** 2 * 3))
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', compress_level=1)
+        return buffer.getvalue()
+
+    def measure(self, function, *args):
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            result = function(*args)
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def report(self, name, peak, size):
+        self.stdout.write(
+            f'{name}: пик {peak / 2 ** 20:.1f} МБ '
+            f'({peak / size:.2f} размера картинки)'
+        )
+
+    def decode_whole(self, data):
+        """Прежний способ: разбиение строки и декодирование целиком."""
+        header, encoded = data.split(';base64,')
+        return ContentFile(base64.b64decode(encoded), name='temp.png')
+
+    def post(self, request, user):
+        force_authenticate(request, user)
+        return RecipeViewSet.as_view({'post': 'create'})(request)
+
+    def handle(self, *args, **options):
+        image = self.make_image(int(options['size'] * 2 ** 20))
+        size = len(image)
+        encoded = 'data:image/png;base64,' + base64.b64encode(image).decode()
+        self.stdout.write(f'Картинка: {size / 2 ** 20:.1f} МБ')
+        for name, function in (
+            ('Base64 целиком', self.decode_whole),
+            ('Base64 по частям', decode_base64_image),
+        ):
+            self.report(name, self.measure(function, encoded)[1], size)
+        factory = APIRequestFactory()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, ALLOWED_HOSTS=['testserver']
+        ), transaction.atomic():
+            user = User.objects.create(
+                username='upload-bench', email='upload-bench@example.com'
+            )
+            tag = Tag.objects.create(
+                name='upload-bench', color='#123456', slug='upload-bench'
+            )
+            ingredient = Ingredient.objects.create(
+                name='upload-bench', measurement_unit='г'
+            )
+            fields = {
+                'text': 'Описание', 'cooking_time': 5, 'tags': [tag.id],
+                'ingredients': [{'id': ingredient.id, 'amount': 1}],
+            }
+            json_request = factory.post(
+                '/api/recipes/',
+                json.dumps({**fields, 'name': 'JSON', 'image': encoded}),
+                content_type='application/json',
+            )
+            multipart_request = factory.post(
+                '/api/recipes/',
+                encode_multipart(BOUNDARY, {
+                    'data': json.dumps({**fields, 'name': 'multipart'}),
+                    'image': ContentFile(image, name='image.png'),
+                }),
+                content_type=MULTIPART_CONTENT,
+            )
+            del encoded
+            for name, request in (
+                ('JSON (Base64)', json_request),
+                ('multipart', multipart_request),
+            ):
+                response, peak = self.measure(self.post, request, user)
+                if response.status_code != 201:
+                    self.stderr.write(f'{name}: {response.data}')
+                self.report(f'Запрос {name}', peak, size)
+            transaction.set_rollback(True)
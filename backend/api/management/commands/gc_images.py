@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from api.constants import IMAGE_GC_GRACE_PERIOD, IMAGE_GC_PASSES
+from api.image_pipeline import garbage_files, image_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаление файлов картинок рецептов и их вариантов, на которые не '
+        'ссылается ни один рецепт.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только вывести файлы, которые были бы удалены.'
+        )
+        parser.add_argument(
+            '--grace', type=int, default=IMAGE_GC_GRACE_PERIOD,
+            help='Не удалять файлы моложе заданного числа секунд.'
+        )
+        parser.add_argument(
+            '--passes', type=int, default=IMAGE_GC_PASSES,
+            help='Число проходов по рецептам (меньше памяти при большем).'
+        )
+
+    def handle(self, *args, **options):
+        storage = image_storage()
+        removed = size = 0
+        for name in garbage_files(options['passes'], options['grace']):
+            removed += 1
+            size += storage.size(name)
+            if options['verbosity'] > 1 or options['dry_run']:
+                self.stdout.write(name)
+            if not options['dry_run']:
+                storage.delete(name)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'{action} файлов: {removed}, {size / 2 ** 20:.1f} МБ.'
+        )
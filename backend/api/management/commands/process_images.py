@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.constants import IMAGE_WORKER_SLEEP
+from api.image_pipeline import enqueue_missing, process_next
+
+
+class Command(BaseCommand):
+    help = (
+        'Обработчик очереди картинок рецептов: уменьшенные копии и их '
+        'версии WebP.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и завершиться.'
+        )
+        parser.add_argument(
+            '--enqueue-missing', action='store_true',
+            help='Поставить в очередь картинки рецептов без вариантов.'
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            self.stdout.write(
+                f'Поставлено в очередь картинок: {enqueue_missing()}.'
+            )
+        processed = 0
+        while True:
+            if process_next():
+                processed += 1
+                continue
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(IMAGE_WORKER_SLEEP)
+        self.stdout.write(f'Обработано задач: {processed}.')
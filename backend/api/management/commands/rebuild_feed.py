@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import rebuild_feed
+from recipes.models import FeedEntry, Subscription
+
+
+class Command(BaseCommand):
+    help = 'Пересчет лент подписок (для стратегии FEED_STRATEGY=fan_out).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество подписчиков, обрабатываемых в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Пересчет лент подписок...')
+        FeedEntry.objects.exclude(
+            user__in=Subscription.objects.values('user_id')
+        ).delete()
+        total = 0
+        last_id = 0
+        while True:
+            user_ids = list(
+                Subscription.objects.filter(user_id__gt=last_id).order_by(
+                    'user_id'
+                ).values_list('user_id', flat=True).distinct()[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            with transaction.atomic():
+                rebuild_feed(user_ids)
+            total += len(user_ids)
+        self.stdout.write(f'Ленты подписок пересчитаны: {total} подписчиков.')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+from recipes.search import update_search_index
+
+
+class Command(BaseCommand):
+    help = 'Пересчет поискового индекса рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество рецептов, обрабатываемых в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Пересчет поискового индекса...')
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Recipe.objects.filter(pk__gt=last_id).order_by(
+                    'pk'
+                ).values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            with transaction.atomic():
+                update_search_index(ids)
+            total += len(ids)
+        self.stdout.write(f'Поисковый индекс пересчитан: {total} рецептов.')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчет агрегированных Списков покупок пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество пользователей, обрабатываемых в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Пересчет Списков покупок...')
+        ShoppingListItem.objects.exclude(
+            user__shopping_cart__isnull=False
+        ).delete()
+        total = 0
+        last_id = 0
+        while True:
+            user_ids = list(
+                ShoppingCart.objects.filter(user_id__gt=last_id).order_by(
+                    'user_id'
+                ).values_list('user_id', flat=True).distinct()[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            ShoppingListItem.objects.rebuild(user_ids)
+            total += len(user_ids)
+        self.stdout.write(
+            f'Списки покупок пересчитаны: {total} пользователей.'
+        )
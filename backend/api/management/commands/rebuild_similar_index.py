@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.similar_index import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Полное построение индекса похожих рецептов (MinHash/LSH).'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Построение индекса похожих рецептов...')
+        start = time.perf_counter()
+        data = rebuild_index()
+        self.stdout.write(
+            f'Индекс похожих рецептов построен: {len(data.ids)} рецептов '
+            f'за {time.perf_counter() - start:.1f} с.'
+        )
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart, Subscription
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Исправление расхождений денормализованных счетчиков.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество объектов, проверяемых в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, field, related_model, related_field in COUNTERS:
+            fixed = 0
+            last_id = 0
+            while True:
+                ids = list(
+                    model.objects.filter(pk__gt=last_id).order_by(
+                        'pk'
+                    ).values_list('pk', flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                last_id = ids[-1]
+                with transaction.atomic():
+                    fixed += model.objects.filter(pk__in=ids).annotate(
+                        actual=count_subquery(related_model, related_field)
+                    ).exclude(**{field: F('actual')}).update(
+                        **{field: count_subquery(related_model, related_field)}
+                    )
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}.{field}: '
+                f'исправлено {fixed}'
+            )
+        self.stdout.write('Счетчики сверены.')
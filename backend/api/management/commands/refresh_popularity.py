@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import POPULARITY_VERSION, bump_version
+from api.pagination import count_version_name
+from recipes.models import Recipe
+from recipes.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет рейтинга популярности рецептов по новым добавлениям в '
+        'избранное и Списки покупок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать рейтинг с нуля, без контрольной точки.'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Пересчет рейтинга популярности...')
+        checkpoint = refresh_popularity(full=options['full'])
+        bump_version(POPULARITY_VERSION, count_version_name(Recipe))
+        self.stdout.write(
+            f'Рейтинг популярности пересчитан: учтены добавления в избранное '
+            f'до id {checkpoint.favorite_id}, в Списки покупок — до id '
+            f'{checkpoint.shopping_cart_id}.'
+        )
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from api.constants import METRIC_EVENTS, METRIC_GROUPS
+
+METRIC_KEY = 'metrics:{}:{}'
+
+
+def increment(group, event, delta=1):
+    """
+    Увеличивает счетчик события `event` группы кэшей `group`, если счетчики
+    включены настройкой CACHE_METRICS.
+    """
+    if not delta or not settings.CACHE_METRICS:
+        return
+    key = METRIC_KEY.format(group, event)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def get_metrics():
+    """Возвращает счетчики событий и долю попаданий по группам кэшей."""
+    keys = {
+        METRIC_KEY.format(group, event): (group, event)
+        for group in METRIC_GROUPS for event in METRIC_EVENTS
+    }
+    values = cache.get_many(keys)
+    metrics = {}
+    for key, (group, event) in keys.items():
+        metrics.setdefault(group, {})[event] = values.get(key, 0)
+    for counters in metrics.values():
+        lookups = counters['hit'] + counters['miss']
+        counters['hit_rate'] = counters['hit'] / lookups if lookups else None
+    return metrics
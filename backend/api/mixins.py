@@ -0,0 +1,88 @@
+import hashlib
+
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.cache import get_version
+from api.constants import REFERENCE_CACHE_CONTROL, REFERENCE_CACHE_TIMEOUT
+from api.metrics import increment
+
+REFERENCE_METRIC_GROUP = 'reference_data'
+
+
+def make_etag(*parts):
+    """Сильный ETag из хэша составных частей версии ответа."""
+    digest = hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag):
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    return etag in if_none_match or '*' in if_none_match
+
+
+def conditional_response(request, etag, cache_control, handler, *args,
+                         **kwargs):
+    """
+    Ответ 304 при совпадении ETag, иначе ответ обработчика. Обработчик (и
+    сериализатор) вызывается только во втором случае.
+    """
+    if etag_matches(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = handler(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept, Authorization'
+    return response
+
+
+class VersionedCacheMixin:
+    """
+    Условные GET-запросы и кэширование ответов по версии таблицы.
+
+    ETag вычисляется из версии `cache_version_name`, формата ответа и пути
+    запроса. При совпадении с `If-None-Match` возвращается 304 без
+    сериализации; иначе данные ответа берутся из кэша текущей версии.
+    """
+    cache_version_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(
+            request, super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+    def versioned_response(self, request, handler, *args, **kwargs):
+        etag = make_etag(
+            get_version(self.cache_version_name),
+            request.accepted_renderer.format,
+            request.get_full_path(),
+        )
+        if etag_matches(request, etag):
+            increment(REFERENCE_METRIC_GROUP, 'not_modified')
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'reference:{etag}'
+            data = cache.get(key)
+            if data is not None:
+                increment(REFERENCE_METRIC_GROUP, 'hit')
+                response = Response(data)
+            else:
+                increment(REFERENCE_METRIC_GROUP, 'miss')
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, REFERENCE_CACHE_TIMEOUT)
+        response['ETag'] = etag
+        response['Cache-Control'] = REFERENCE_CACHE_CONTROL
+        response['Vary'] = 'Accept'
+        return response
@@ -1,5 +1,167 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from functools import partial
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from api.cache import get_version
+from api.constants import (
+    COUNT_CACHE_TIMEOUT, COUNT_ESTIMATE_THRESHOLD, COUNT_STRATEGY_CACHED,
+    COUNT_STRATEGY_ESTIMATED, COUNT_STRATEGY_EXACT
+)
+from api.metrics import increment
+
+COUNT_CACHE_KEY = 'count:{}:{}'
+COUNT_METRIC_GROUP = 'pagination_count'
+
+
+def count_version_name(model):
+    """Имя версии, при смене которой сбрасываются кэши числа объектов."""
+    return f'count:{model._meta.label_lower}'
+
+
+def exact_count(queryset):
+    return queryset.count()
+
+
+def cached_count(queryset):
+    """
+    Число объектов, закэшированное по тексту SQL-запроса подсчета (то есть
+    по нормализованному набору фильтров) и версии модели. Аннотации и
+    сортировка в ключ не входят: выборки, различающиеся только признаками
+    читателя, делят одно значение.
+    """
+    try:
+        sql, params = queryset.values('pk').order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    key = COUNT_CACHE_KEY.format(
+        get_version(count_version_name(queryset.model)), digest
+    )
+    count = cache.get(key)
+    if count is not None:
+        increment(COUNT_METRIC_GROUP, 'hit')
+        return count
+    increment(COUNT_METRIC_GROUP, 'miss')
+    count = queryset.count()
+    cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def estimated_count(queryset):
+    """
+    Оценка числа объектов планировщиком PostgreSQL. Для небольших выборок и
+    других СУБД выполняется точный подсчет.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        estimate = cursor.fetchone()[0][0]['Plan']['Plan Rows']
+    if estimate < COUNT_ESTIMATE_THRESHOLD:
+        return queryset.count()
+    increment(COUNT_METRIC_GROUP, 'estimate')
+    return int(estimate)
+
+
+COUNT_STRATEGIES = {
+    COUNT_STRATEGY_EXACT: exact_count,
+    COUNT_STRATEGY_CACHED: cached_count,
+    COUNT_STRATEGY_ESTIMATED: estimated_count,
+}
+
+
+class CountStrategyPaginator(Paginator):
+    """Paginator, вычисляющий общее число объектов выбранной стратегией."""
+
+    def __init__(self, *args, count_strategy=COUNT_STRATEGY_EXACT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_strategy = COUNT_STRATEGIES[count_strategy]
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+        return self.count_strategy(self.object_list)
+
+
+class LimitCursorPagination(CursorPagination):
+    """
+    Пагинация по курсору: выборка следующей страницы по значению ключа
+    сортировки без подсчета общего числа объектов и без OFFSET.
+    """
+    page_size_query_param = 'limit'
 
 
 class PageLimitPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с параметром `limit`.
+
+    Стратегия подсчета общего числа объектов задается атрибутом вьюсета
+    `count_strategy`: `exact`, `cached` или `estimated`.
+
+    Если у вьюсета задан `cursor_ordering`, действие входит в
+    `cursor_actions` (по умолчанию только `list`) и в запросе передан
+    параметр `cursor` (в том числе пустой), используется пагинация по
+    курсору. Остальные действия сохраняют собственную сортировку, как и
+    запросы с параметрами из `cursor_excluded_params` вьюсета (например,
+    поиск, упорядоченный по релевантности).
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_actions = ('list',)
+    count_strategy = COUNT_STRATEGY_EXACT
+
+    def use_cursor(self, request, view):
+        return (
+            getattr(view, 'cursor_ordering', None) is not None
+            and getattr(view, 'action', None) in getattr(
+                view, 'cursor_actions', self.cursor_actions
+            )
+            and self.cursor_query_param in request.query_params
+            and not any(
+                param in request.query_params
+                for param in getattr(view, 'cursor_excluded_params', ())
+            )
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.use_cursor(request, view):
+            self.cursor_pagination = LimitCursorPagination()
+            self.cursor_pagination.ordering = view.cursor_ordering
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view
+            )
+        self.django_paginator_class = partial(
+            CountStrategyPaginator,
+            count_strategy=getattr(
+                view, 'count_strategy', self.count_strategy
+            ),
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ListPagination(PageLimitPagination):
+    """
+    Постраничная пагинация готового списка (например, id, упорядоченных
+    по индексу в памяти): параметр `cursor` не действует.
+    """
+
+    def use_cursor(self, request, view):
+        return False
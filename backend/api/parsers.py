@@ -0,0 +1,38 @@
+import json
+
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+from api.constants import RECIPE_UPLOAD_MAX_SIZE, ErrorMessage
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+    Multipart-запрос, в котором поля объекта переданы JSON-объектом в части
+    `data`, а файлы — отдельными частями. Файлы больше
+    FILE_UPLOAD_MAX_MEMORY_SIZE записываются во временные файлы по частям и
+    не попадают в память целиком. Запрос больше RECIPE_UPLOAD_MAX_SIZE
+    отклоняется по заголовку Content-Length, до чтения тела.
+
+    Файлы добавляются в `request.data` под именами частей, а `request.FILES`
+    остается пустым: иначе DRF заменил бы их в `request.data` списками.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        meta = parser_context['request'].META
+        try:
+            length = int(meta.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > RECIPE_UPLOAD_MAX_SIZE:
+            raise ParseError(ErrorMessage.IMAGE_TOO_LARGE)
+        parsed = super().parse(stream, media_type, parser_context)
+        try:
+            data = json.loads(parsed.data.get('data', '{}'))
+        except ValueError:
+            raise ParseError(ErrorMessage.MULTIPART_DATA)
+        if not isinstance(data, dict):
+            raise ParseError(ErrorMessage.MULTIPART_DATA)
+        data.update(parsed.files.dict())
+        return DataAndFiles(data, MultiValueDict())
@@ -0,0 +1,76 @@
+import threading
+
+import numpy as np
+
+from api.cache import RECIPE_INGREDIENTS_VERSION, get_version
+from recipes.models import IngredientRecipe
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс ингредиентов в памяти процесса: для каждого ингредиента
+    отсортированный массив номеров рецептов, в которые он входит.
+
+    Индекс строится при первом обращении и перестраивается, когда меняется
+    версия состава рецептов. Число имеющихся ингредиентов каждого рецепта
+    считается одним вызовом `np.bincount` по спискам выбранных ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._recipe_ids = np.empty(0, dtype=np.int64)
+        self._sizes = np.empty(0, dtype=np.int32)
+        self._postings = {}
+
+    def _build(self, version):
+        pairs = np.array(
+            list(IngredientRecipe.objects.order_by(
+                'ingredient_id', 'recipe_id'
+            ).values_list('ingredient_id', 'recipe_id').iterator()),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        recipe_ids, rows = np.unique(pairs[:, 1], return_inverse=True)
+        rows = rows.astype(np.int32)
+        ingredient_ids, starts = np.unique(pairs[:, 0], return_index=True)
+        self._postings = dict(zip(
+            ingredient_ids.tolist(), np.split(rows, starts[1:])
+        ))
+        self._recipe_ids = recipe_ids
+        self._sizes = np.bincount(rows, minlength=len(recipe_ids))
+        self._version = version
+
+    def _ensure_built(self):
+        version = get_version(RECIPE_INGREDIENTS_VERSION)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build(version)
+        return self._recipe_ids, self._sizes, self._postings
+
+    def search(self, ingredient_ids, missing=0):
+        """
+        Id рецептов, в которых есть хотя бы один из ингредиентов
+        `ingredient_ids` и недостает не более `missing` ингредиентов.
+        Рецепты упорядочены по числу недостающих ингредиентов, затем по
+        числу имеющихся (по убыванию) и от новых к старым.
+        """
+        recipe_ids, sizes, postings = self._ensure_built()
+        lists = [
+            postings[ingredient_id] for ingredient_id in set(ingredient_ids)
+            if ingredient_id in postings
+        ]
+        if not lists:
+            return []
+        present = np.bincount(
+            np.concatenate(lists), minlength=len(recipe_ids)
+        )
+        lacking = sizes - present
+        rows = np.flatnonzero((present > 0) & (lacking <= missing))
+        order = np.lexsort((
+            -recipe_ids[rows], -present[rows], lacking[rows]
+        ))
+        return recipe_ids[rows[order]].tolist()
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -0,0 +1,46 @@
+import threading
+
+from api.cache import INGREDIENTS_VERSION, TAGS_VERSION, get_version
+from recipes.models import Ingredient, Tag
+
+
+class ReferenceTable:
+    """
+    Объекты справочника в памяти процесса, по id.
+
+    Таблица загружается целиком при первом обращении и перечитывается,
+    когда меняется ее версия. Объекты общие для всех запросов процесса и
+    не должны изменяться.
+    """
+
+    def __init__(self, model, version_name):
+        self.model = model
+        self.version_name = version_name
+        self._lock = threading.Lock()
+        self._version = None
+        self._objects = {}
+
+    def _ensure_loaded(self):
+        version = get_version(self.version_name)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._objects = self.model.objects.in_bulk()
+                    self._version = version
+        return self._objects
+
+    def in_bulk(self, ids):
+        """
+        Словарь id → объект для найденных `ids`. Отсутствующие в памяти id
+        (например, добавленные до смены версии) ищутся одним запросом.
+        """
+        objects = self._ensure_loaded()
+        found = {pk: objects[pk] for pk in ids if pk in objects}
+        missing = set(ids) - found.keys()
+        if missing:
+            found.update(self.model.objects.in_bulk(missing))
+        return found
+
+
+tag_table = ReferenceTable(Tag, TAGS_VERSION)
+ingredient_table = ReferenceTable(Ingredient, INGREDIENTS_VERSION)
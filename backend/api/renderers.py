@@ -0,0 +1,89 @@
+import csv
+import json
+from io import StringIO
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер файла Списка покупок. Строки списка - словари с ключами
+    `name`, `measurement_unit` и `amount`; файл формируется генератором
+    `render_rows` по частям, чтобы его можно было отдавать потоком.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return json.dumps(data, ensure_ascii=False).encode(self.charset)
+        return ''.join(self.render_rows(data)).encode(self.charset)
+
+    def render_rows(self, rows):
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render_rows(self, rows):
+        yield 'Список покупок:'
+        empty = True
+        for row in rows:
+            empty = False
+            yield (
+                f'\n- {row["name"]} ({row["measurement_unit"]}) - '
+                f'{row["amount"]}'
+            )
+        if empty:
+            yield '\nВ Списке покупок отсутствуют рецепты.'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    fields = ('name', 'measurement_unit', 'amount')
+
+    def render_rows(self, rows):
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.fields)
+        for row in rows:
+            writer.writerow([row[field] for field in self.fields])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render_rows(self, rows):
+        separator = '['
+        for row in rows:
+            yield separator + json.dumps(row, ensure_ascii=False)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer, ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+)
+
+
+class FormatContentNegotiation(DefaultContentNegotiation):
+    """
+    Выбор рендерера только по параметру `format` (или суффиксу формата):
+    без него используется первый рендерер независимо от заголовка Accept.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query_param = self.settings.URL_FORMAT_OVERRIDE
+        format = format_suffix or request.query_params.get(format_query_param)
+        if format:
+            renderers = self.filter_renderers(renderers, format)
+        return renderers[0], renderers[0].media_type
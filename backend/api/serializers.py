@@ -1,24 +1,44 @@
 import base64
+import binascii
 from djoser.serializers import UserSerializer, UserCreateSerializer
 
 from django.db import transaction
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
+from api.cache import get_or_render_many, recipe_representation_keys
 from api.constants import (
-    MAX_VALUE_AMOUNT, MAX_VALUE_COOKING_TIME, MIN_VALUE_AMOUNT,
-    MIN_VALUE_COOKING_TIME, ErrorMessage
+    BASE64_CHUNK_SIZE, BASE64_HEADER_MAX_LENGTH, MAX_VALUE_AMOUNT,
+    MAX_VALUE_COOKING_TIME, MIN_VALUE_AMOUNT, MIN_VALUE_COOKING_TIME,
+    RECIPE_CACHE_TIMEOUT, RECIPE_IMAGE_MAX_SIZE, ErrorMessage
 )
+from api.image_pipeline import VARIANT_NAMES
+from api.reference_tables import ingredient_table, tag_table
+from api.signals import recipe_ingredients_bulk_changed
 from recipes.models import (
-    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Subscription,
-    Tag
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingListItem, Subscription, Tag, TagRecipe, recipe_related_lookups
 )
 
 User = get_user_model()
 
 
+def followed_author_ids(request):
+    """
+    Множество id авторов, на которых подписан пользователь запроса.
+    Загружается одним запросом и хранится в объекте запроса.
+    """
+    if not request.user.is_authenticated:
+        return frozenset()
+    if not hasattr(request, 'followed_author_ids'):
+        request.followed_author_ids = frozenset(
+            request.user.subscriptions.values_list('author_id', flat=True)
+        )
+    return request.followed_author_ids
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Сериализатор для создания пользователя"""
     class Meta:
@@ -43,11 +63,7 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if not user.is_authenticated:
-            return False
-        author = get_object_or_404(User, id=obj.id)
-        return Subscription.objects.filter(user=user, author=author).exists()
+        return obj.id in followed_author_ids(self.context['request'])
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -71,31 +87,128 @@ class IngredientSerializer(serializers.ModelSerializer):
         )
 
 
+def decode_base64_image(data):
+    """
+    Декодирует картинку из data URI во временный файл по частям по
+    BASE64_CHUNK_SIZE символов, не создавая копий всей строки. Слишком
+    большая картинка отклоняется по длине строки, до декодирования.
+    """
+    separator = data.find(';base64,', 0, BASE64_HEADER_MAX_LENGTH)
+    if separator < 0:
+        raise serializers.ValidationError(ErrorMessage.IMAGE_BASE64)
+    start = separator + len(';base64,')
+    if (len(data) - start) // 4 * 3 > RECIPE_IMAGE_MAX_SIZE:
+        raise serializers.ValidationError(ErrorMessage.IMAGE_TOO_LARGE)
+    ext = data[:separator].split('/')[-1]
+    image = TemporaryUploadedFile(f'temp.{ext}', f'image/{ext}', 0, None)
+    remainder = ''
+    try:
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            chunk = remainder + ''.join(
+                data[position:position + BASE64_CHUNK_SIZE].split()
+            )
+            end = len(chunk) - len(chunk) % 4
+            image.write(base64.b64decode(chunk[:end], validate=True))
+            remainder = chunk[end:]
+        if remainder:
+            raise binascii.Error
+    except binascii.Error:
+        image.close()
+        raise serializers.ValidationError(ErrorMessage.IMAGE_BASE64)
+    image.size = image.tell()
+    image.seek(0)
+    return image
+
+
 class Base64ImageField(serializers.ImageField):
-    """Поле сериализатора для преобразования Base64 в картинку"""
+    """
+    Поле сериализатора для картинки в Base64 (data URI) или загруженной
+    файлом в multipart-запросе
+    """
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = decode_base64_image(data)
+        elif getattr(data, 'size', 0) > RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(ErrorMessage.IMAGE_TOO_LARGE)
         return super().to_internal_value(data)
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Поле первичного ключа, которое ищет объекты в заранее загруженном
+    словаре `objects` (id → объект) вместо запроса на каждый id. Ошибки
+    те же, что у PrimaryKeyRelatedField.
+    """
+    objects = None
+
+    def to_internal_value(self, data):
+        if self.objects is None:
+            return super().to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.objects:
+            self.fail('does_not_exist', pk_value=data)
+        return self.objects[pk]
+
+
+def collect_ids(values, key=None):
+    """
+    Целочисленные id из списка значений (или из поля `key` словарей
+    списка); прочие значения пропускаются.
+    """
+    ids = set()
+    if not isinstance(values, (list, tuple)):
+        return ids
+    for value in values:
+        if key is not None:
+            value = value.get(key) if isinstance(value, dict) else None
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+
 class RecipeBaseSerializer(serializers.ModelSerializer):
     """
     Сериализатор рецептов с минимальным набором полей для отображения в
     подписках, избранном и списке покупок
     """
     image = Base64ImageField()
+    images = serializers.SerializerMethodField()
     cooking_time = serializers.IntegerField(
         min_value=MIN_VALUE_COOKING_TIME, max_value=MAX_VALUE_COOKING_TIME
     )
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time',)
+        fields = ('id', 'name', 'image', 'images', 'cooking_time',)
         read_only_field = ('id', 'name', 'image', 'cooking_time',)
 
+    def get_images(self, obj):
+        """
+        Адреса уменьшенных копий картинки и их версий WebP; пока картинка
+        не обработана — адрес оригинала.
+        """
+        if not obj.image:
+            return None
+        request = self.context.get('request')
+        variants = obj.image_variants or {}
+        images = {}
+        for variant in VARIANT_NAMES:
+            url = (
+                obj.image.storage.url(variants[variant])
+                if variant in variants else obj.image.url
+            )
+            images[variant] = (
+                request.build_absolute_uri(url) if request else url
+            )
+        return images
+
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для связей рецептов-ингредиентов при отображении рецепта"""
@@ -110,6 +223,52 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Сериализатор для ингредиентов из Списка покупок"""
+    id = serializers.IntegerField(source='ingredient.id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit'
+    )
+    amount = serializers.IntegerField(source='total_amount')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class RecipeAuthorSerializer(serializers.ModelSerializer):
+    """Сериализатор автора рецепта без полей, зависящих от читателя"""
+    class Meta:
+        model = User
+        fields = ('email', 'id', 'username', 'first_name', 'last_name',)
+
+
+class RecipeSharedSerializer(RecipeBaseSerializer):
+    """
+    Сериализатор общей для всех читателей части представления рецепта,
+    которая кэшируется
+    """
+    tags = TagSerializer(many=True)
+    author = RecipeAuthorSerializer()
+    ingredients = IngredientRecipeSerializer(
+        many=True, source='ingredientrecipe'
+    )
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id', 'tags', 'author', 'ingredients', 'name', 'image', 'images',
+            'text', 'cooking_time',
+        )
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Сериализатор списка рецептов с пакетным чтением кэша"""
+    def to_representation(self, data):
+        return self.child.to_representation_many(list(data))
+
+
 class RecipeSerializer(RecipeBaseSerializer):
     """Сериализатор для отображения рецептов"""
     tags = TagSerializer(many=True)
@@ -128,7 +287,8 @@ class RecipeSerializer(RecipeBaseSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
+            'is_in_shopping_cart', 'name', 'image', 'images', 'text',
+            'cooking_time',
         )
         validators = (
             serializers.UniqueTogetherValidator(
@@ -137,8 +297,54 @@ class RecipeSerializer(RecipeBaseSerializer):
                 message=ErrorMessage.ALREADY_EXIST_RECIPE_AUTHOR
             ),
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, instances):
+        """
+        Собирает представления рецептов из закэшированной общей части и
+        признаков, зависящих от читателя.
+        """
+        request = self.context['request']
+        shared = get_or_render_many(
+            recipe_representation_keys(
+                instances, request.build_absolute_uri('/')
+            ),
+            lambda indexes: self.render_shared(
+                [instances[index] for index in indexes]
+            ),
+            RECIPE_CACHE_TIMEOUT, 'recipe_representation',
+        )
+        author_serializer = CustomUserSerializer(context=self.context)
+        representations = []
+        for instance, data in zip(instances, shared):
+            data = dict(data)
+            data['author'] = dict(
+                data['author'],
+                is_subscribed=author_serializer.get_is_subscribed(
+                    instance.author
+                ),
+            )
+            data['is_favorited'] = self.get_is_favorited(instance)
+            data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(
+                instance
+            )
+            representations.append(
+                {field: data[field] for field in self.Meta.fields}
+            )
+        return representations
+
+    def render_shared(self, instances):
+        prefetch_related_objects(instances, *recipe_related_lookups())
+        return RecipeSharedSerializer(
+            instances, many=True, context=self.context
+        ).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if not user.is_authenticated:
             return False
@@ -147,6 +353,8 @@ class RecipeSerializer(RecipeBaseSerializer):
         ).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if not user.is_authenticated:
             return False
@@ -160,7 +368,7 @@ class IngredientRecipeBaseSerializer(serializers.ModelSerializer):
     Сериализатор для обработки связей рецептов с ингредиентами при создании и
     изменении рецепта
     """
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = PreloadedPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(
         min_value=MIN_VALUE_AMOUNT, max_value=MAX_VALUE_AMOUNT
     )
@@ -172,7 +380,7 @@ class IngredientRecipeBaseSerializer(serializers.ModelSerializer):
 
 class RecipeCreateUpdateSerializer(RecipeSerializer):
     """Сериализатор для создания и изменения рецептов"""
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = PreloadedPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True
     )
     author = CustomUserSerializer(
@@ -182,37 +390,105 @@ class RecipeCreateUpdateSerializer(RecipeSerializer):
         many=True, source='ingredientrecipe'
     )
 
+    def to_internal_value(self, data):
+        """
+        Перед проверкой полей загружает все указанные теги и ингредиенты
+        из справочников в памяти процесса (или одним запросом на таблицу).
+        """
+        if hasattr(data, 'get'):
+            self.fields['tags'].child_relation.objects = tag_table.in_bulk(
+                collect_ids(data.get('tags'))
+            )
+            self.fields['ingredients'].child.fields['id'].objects = (
+                ingredient_table.in_bulk(
+                    collect_ids(data.get('ingredients'), 'id')
+                )
+            )
+        return super().to_internal_value(data)
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredientrecipe')
         recipe = Recipe.objects.create(**validated_data)
-        for tag in tags:
-            recipe.tags.add(tag)
-        for ingredient in ingredients:
-            IngredientRecipe.objects.create(
-                ingredient=ingredient['id'],
-                recipe=recipe, amount=ingredient['amount']
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=tag) for tag in tags
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient=ingredient['id'],
+                amount=ingredient['amount'],
             )
+            for ingredient in ingredients
+        )
+        recipe_ingredients_bulk_changed(recipe.id, {})
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags', [])
-        ingredients = validated_data.pop('ingredientrecipe', {})
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredientrecipe', None)
         super().update(instance, validated_data)
         if tags:
-            instance.tags.clear()
-            instance.tags.set(tags)
+            self.update_tags(instance, tags)
         if ingredients:
-            IngredientRecipe.objects.filter(recipe=instance).delete()
-            for ingredient in ingredients:
-                IngredientRecipe.objects.create(
-                    ingredient=ingredient['id'],
-                    recipe=instance, amount=ingredient['amount']
-                )
+            self.update_ingredients(instance, ingredients)
         return instance
 
+    def update_tags(self, instance, tags):
+        """Удаляет снятые теги и добавляет новые, не трогая остальные."""
+        current = set(instance.tags.values_list('id', flat=True))
+        tag_ids = {tag.id for tag in tags}
+        if current - tag_ids:
+            instance.tags.remove(*(current - tag_ids))
+        if tag_ids - current:
+            instance.tags.add(*(tag_ids - current))
+
+    def update_ingredients(self, instance, ingredients):
+        """
+        Применяет разницу между текущими и новыми ингредиентами рецепта:
+        удаляет лишние строки, меняет количество измененных и добавляет
+        новые — фиксированным числом запросов.
+        """
+        current = {
+            item.ingredient_id: item
+            for item in IngredientRecipe.objects.filter(recipe=instance)
+        }
+        amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        deltas = {}
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id, 0)
+            if amount != item.amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        removed = [item for item in changed if not item.amount]
+        changed = [item for item in changed if item.amount]
+        added = [
+            IngredientRecipe(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        deltas.update((item.ingredient_id, item.amount) for item in added)
+        if not deltas:
+            return
+        if removed:
+            # удаление без сигналов по каждой строке: последствия изменения
+            # состава рецепта применяются ниже одним вызовом
+            queryset = IngredientRecipe.objects.filter(
+                pk__in=[item.id for item in removed]
+            )
+            queryset._raw_delete(queryset.db)
+        IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        IngredientRecipe.objects.bulk_create(added)
+        recipe_ingredients_bulk_changed(instance.id, deltas)
+
     def validate_tags(self, value):
         if not value:
             raise serializers.ValidationError(
@@ -241,6 +517,9 @@ class RecipeCreateUpdateSerializer(RecipeSerializer):
         return data
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_related().with_user_flags(
+            self.context['request'].user
+        ).get(pk=instance.pk)
         return RecipeSerializer(instance, context=self.context).data
 
 
@@ -256,25 +535,37 @@ class UserWithRecipeSerializer(CustomUserSerializer):
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count',)
 
+    @staticmethod
+    def get_recipes_limit(request):
+        recipes_limit = request.GET.get('recipes_limit')
+        if not recipes_limit:
+            return None
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            raise serializers.ValidationError(ErrorMessage.RECIPES_LIMIT_TYPE)
+        if recipes_limit < 0:
+            raise serializers.ValidationError(
+                ErrorMessage.RECIPES_LIMIT_NOT_POSITIVE
+            )
+        return recipes_limit
+
+    def get_is_subscribed(self, obj):
+        """Автор отображается в Подписках, значит, подписка есть."""
+        return True
+
     def get_recipes(self, obj):
-        recipes_limit = self.context['request'].GET.get('recipes_limit')
-        instance = obj.recipes.all()
-        if recipes_limit:
-            try:
-                recipes_limit = int(recipes_limit)
-            except ValueError:
-                raise serializers.ValidationError(
-                    ErrorMessage.RECIPES_LIMIT_TYPE
-                )
-            if recipes_limit < 0:
-                raise serializers.ValidationError(
-                    ErrorMessage.RECIPES_LIMIT_NOT_POSITIVE
-                )
-            instance = instance[:recipes_limit]
+        author_recipes = self.context.get('author_recipes')
+        if author_recipes is not None:
+            instance = author_recipes[obj.id]
+        else:
+            instance = Recipe.objects.latest_by_author(
+                (obj.id,), self.get_recipes_limit(self.context['request'])
+            )[obj.id]
         return RecipeBaseSerializer(instance, many=True).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
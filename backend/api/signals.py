@@ -0,0 +1,342 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.cache import (
+    CART_VERSION, INGREDIENTS_VERSION, RECIPE_INGREDIENTS_VERSION,
+    RECIPE_VERSION, TAGS_VERSION, USER_VERSION, bump_version, invalidate
+)
+from api.metrics import increment
+from api.pagination import COUNT_METRIC_GROUP, count_version_name
+from api.similar_index import schedule_signature_update
+from recipes.feed import (
+    backfill_feed, fan_out_enabled, fan_out_recipe, prune_feed
+)
+from recipes.models import (
+    Favorite, ImageTask, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingListItem, Subscription, Tag, TagRecipe
+)
+from recipes.search import schedule_search_index_update
+
+User = get_user_model()
+REPRESENTATION_METRIC_GROUP = 'recipe_representation'
+
+# модель связи: (поле связи, модель и поле счетчика)
+COUNTERS = {
+    Recipe: ('author', User, 'recipes_count'),
+    Favorite: ('recipe', Recipe, 'favorites_count'),
+    ShoppingCart: ('recipe', Recipe, 'shopping_cart_count'),
+    Subscription: ('author', User, 'followers_count'),
+}
+
+
+def invalidate_counts(model):
+    bump_version(count_version_name(model))
+    increment(COUNT_METRIC_GROUP, 'eviction')
+
+
+def change_counter(model, ids, delta):
+    """
+    Атомарно изменяет счетчик объектов, на которые указывают связи модели
+    `model`, у объектов с заданными id. Счетчик не опускается ниже нуля,
+    даже если он разошелся с данными (исправляет reconcile_counters).
+    """
+    _, counter_model, field = COUNTERS[model]
+    counter_model.objects.filter(pk__in=ids).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+def counted_object_created(sender, instance, created, **kwargs):
+    """
+    Счетчики меняются сигналами, поэтому учитываются и объекты, созданные
+    не через API: в админке, командами загрузки данных или через ORM.
+    """
+    if created:
+        field = COUNTERS[sender][0]
+        change_counter(sender, (getattr(instance, f'{field}_id'),), 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def counted_object_deleted(sender, instance, **kwargs):
+    field = COUNTERS[sender][0]
+    change_counter(sender, (getattr(instance, f'{field}_id'),), -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_set_changed(sender, created=False, **kwargs):
+    """
+    Добавление рецепта меняет число рецептов в выборках. Числа в выборках
+    по избранному и Списку покупок читателя обновляются по истечении
+    COUNT_CACHE_TIMEOUT, чтобы их изменения не сбрасывали общие счетчики.
+    """
+    if created:
+        invalidate_counts(Recipe)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_set_deleted(sender, **kwargs):
+    invalidate_counts(Recipe)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(sender, created=False, **kwargs):
+    if created:
+        invalidate_counts(Subscription)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, **kwargs):
+    invalidate_counts(Subscription)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    if created and fan_out_enabled():
+        fan_out_recipe(instance)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_feed_created(sender, instance, created, **kwargs):
+    if created and fan_out_enabled():
+        backfill_feed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_feed_deleted(sender, instance, **kwargs):
+    if fan_out_enabled():
+        prune_feed(instance.user_id, instance.author_id)
+
+
+def relations_bulk_created(model, user_id, target_ids):
+    """
+    Последствия массового добавления связей пользователя с рецептами или
+    авторами (bulk_create), для которых сигналы по каждой строке не
+    отправляются.
+    """
+    if not target_ids:
+        return
+    change_counter(model, target_ids, 1)
+    if model is Subscription:
+        invalidate_counts(Subscription)
+        if fan_out_enabled():
+            backfill_feed(user_id, *target_ids)
+    elif model is ShoppingCart:
+        invalidate('shopping_list', CART_VERSION.format(user_id))
+        ShoppingListItem.objects.add_recipes(user_id, target_ids)
+
+
+def relations_bulk_deleted(model, user_id, target_ids):
+    """
+    Последствия массового удаления связей пользователя с рецептами или
+    авторами одним запросом, без сигналов по каждой строке.
+    """
+    if not target_ids:
+        return
+    change_counter(model, target_ids, -1)
+    if model is Subscription:
+        invalidate_counts(Subscription)
+        if fan_out_enabled():
+            prune_feed(user_id, *target_ids)
+    elif model is ShoppingCart:
+        invalidate('shopping_list', CART_VERSION.format(user_id))
+        ShoppingListItem.objects.remove_recipes(user_id, target_ids)
+
+
+def invalidate_recipes(*recipe_ids):
+    invalidate(
+        REPRESENTATION_METRIC_GROUP,
+        *(RECIPE_VERSION.format(recipe_id) for recipe_id in recipe_ids)
+    )
+
+
+def invalidate_carts(*recipe_ids):
+    """Сбрасывает кэш Списков покупок, в которых есть эти рецепты."""
+    invalidate('shopping_list', *(
+        CART_VERSION.format(user_id)
+        for user_id in ShoppingCart.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('user_id', flat=True).distinct()
+    ))
+
+
+def touch_recipes(*recipe_ids):
+    """
+    Обновляет дату изменения рецептов, у которых изменились связанные
+    объекты, и сбрасывает их закэшированные представления.
+    """
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        updated_at=timezone.now()
+    )
+    invalidate_recipes(*recipe_ids)
+    invalidate_carts(*recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes(instance.id)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_image_saving(sender, instance, **kwargs):
+    """
+    Новая картинка рецепта (еще не записанная в хранилище) сбрасывает ее
+    варианты: до обработки отдается оригинал.
+    """
+    instance._image_changed = (
+        bool(instance.image) and not instance.image._committed
+    )
+    if instance._image_changed:
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, **kwargs):
+    if getattr(instance, '_image_changed', False):
+        ImageTask.objects.create(recipe=instance, image=instance.image.name)
+        instance._image_changed = False
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_carts(instance.id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    invalidate('shopping_list', CART_VERSION.format(instance.user_id))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_added(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipes(
+            instance.user_id, (instance.recipe_id,)
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_removed(sender, instance, **kwargs):
+    ShoppingListItem.objects.remove_recipes(
+        instance.user_id, (instance.recipe_id,)
+    )
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def recipe_ingredient_saving(sender, instance, **kwargs):
+    """Запоминает прежнее количество ингредиента для пересчета Списков."""
+    instance._previous_amount = None
+    if instance.pk is not None:
+        instance._previous_amount = IngredientRecipe.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def recipe_ingredient_saved(sender, instance, **kwargs):
+    deltas = {instance.ingredient_id: instance.amount}
+    previous = getattr(instance, '_previous_amount', None)
+    if previous is not None:
+        recipe_id, ingredient_id, amount = previous
+        if recipe_id != instance.recipe_id:
+            ShoppingListItem.objects.apply_recipe_change(
+                recipe_id, {ingredient_id: -amount}
+            )
+        else:
+            deltas[ingredient_id] = deltas.get(ingredient_id, 0) - amount
+    ShoppingListItem.objects.apply_recipe_change(instance.recipe_id, deltas)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    ShoppingListItem.objects.apply_recipe_change(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_search_document_changed(sender, instance, **kwargs):
+    schedule_search_index_update(instance.id)
+
+
+def recipe_ingredients_bulk_changed(recipe_id, deltas):
+    """
+    Последствия массовой записи ингредиентов рецепта, при которой сигналы
+    по каждой строке не отправляются. `deltas` — изменения количества
+    ингредиентов для Списков покупок.
+    """
+    schedule_signature_update(recipe_id)
+    invalidate(None, RECIPE_INGREDIENTS_VERSION)
+    ShoppingListItem.objects.apply_recipe_change(recipe_id, deltas)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    schedule_search_index_update(instance.recipe_id)
+    schedule_signature_update(instance.recipe_id)
+    invalidate(None, RECIPE_INGREDIENTS_VERSION)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+def recipe_relation_changed(sender, instance, **kwargs):
+    touch_recipes(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            touch_recipes(instance.id)
+    elif action in ('post_add', 'post_remove'):
+        touch_recipes(*pk_set)
+    elif action == 'pre_clear':
+        touch_recipes(*instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate(REPRESENTATION_METRIC_GROUP, USER_VERSION.format(instance.id))
+    if not created:
+        instance.recipes.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    invalidate(REPRESENTATION_METRIC_GROUP, TAGS_VERSION)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    invalidate(REPRESENTATION_METRIC_GROUP, INGREDIENTS_VERSION)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    if not created:
+        schedule_search_index_update(*instance.ingredientrecipe.values_list(
+            'recipe_id', flat=True
+        ))
@@ -0,0 +1,315 @@
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from api.cache import SIMILAR_VERSION, bump_version, get_version
+from api.constants import (
+    SIMILAR_BANDS, SIMILAR_BUILD_CHUNK, SIMILAR_NUM_PERM, SIMILAR_SEED
+)
+from recipes.models import IngredientRecipe, Recipe, RecipeSignature
+
+PRIME = (1 << 31) - 1
+CURRENT_FILE = 'CURRENT'
+ARRAYS = ('ids', 'signatures', 'band_sorted', 'band_order')
+
+_random = np.random.default_rng(SIMILAR_SEED)
+_HASH_A = _random.integers(1, PRIME, SIMILAR_NUM_PERM, dtype=np.uint64)
+_HASH_B = _random.integers(0, PRIME, SIMILAR_NUM_PERM, dtype=np.uint64)
+_BAND_MULTIPLIERS = _random.integers(
+    1, 1 << 63, SIMILAR_NUM_PERM // SIMILAR_BANDS, dtype=np.uint64
+) | np.uint64(1)
+
+_pending = threading.local()
+
+
+def compute_signatures(offsets, ingredient_ids, chunk=SIMILAR_BUILD_CHUNK):
+    """
+    MinHash-сигнатуры наборов ингредиентов.
+
+    `ingredient_ids` — id ингредиентов, сгруппированные по рецептам,
+    `offsets` — начало набора каждого рецепта. Хэши вычисляются матрицей
+    (число перестановок × число пар) по частям не более `chunk` пар,
+    минимумы по наборам — `np.minimum.reduceat`.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    values = np.asarray(ingredient_ids, dtype=np.uint64) % np.uint64(PRIME)
+    ends = np.append(offsets[1:], len(values))
+    signatures = np.full(
+        (len(offsets), SIMILAR_NUM_PERM), PRIME, dtype=np.uint32
+    )
+    start = 0
+    while start < len(offsets):
+        stop = max(
+            int(np.searchsorted(offsets, offsets[start] + chunk, 'right')),
+            start + 1
+        )
+        first, last = offsets[start], ends[stop - 1]
+        if last > first:
+            hashes = (
+                _HASH_A[:, None] * values[None, first:last] + _HASH_B[:, None]
+            ) % np.uint64(PRIME)
+            nonempty = ends[start:stop] > offsets[start:stop]
+            reduced = np.minimum.reduceat(
+                hashes, offsets[start:stop][nonempty] - first, axis=1
+            )
+            signatures[start:stop][nonempty] = reduced.T
+        start = stop
+    return signatures
+
+
+def band_hashes(signatures):
+    """Хэши полос LSH: по одному 64-битному значению на полосу."""
+    signatures = np.asarray(signatures, dtype=np.uint64)
+    return (
+        signatures.reshape(
+            len(signatures), SIMILAR_BANDS, SIMILAR_NUM_PERM // SIMILAR_BANDS
+        )
+        * _BAND_MULTIPLIERS
+    ).sum(axis=2, dtype=np.uint64)
+
+
+class IndexData:
+    """
+    Индекс похожих рецептов: отсортированные id рецептов, их сигнатуры и
+    корзины LSH — для каждой полосы отсортированные хэши и номера строк.
+    """
+
+    def __init__(self, ids, signatures, band_sorted, band_order):
+        self.ids = ids
+        self.signatures = signatures
+        self.band_sorted = band_sorted
+        self.band_order = band_order
+
+    @classmethod
+    def empty(cls):
+        return cls.from_signatures(
+            np.empty(0, dtype=np.int64),
+            np.empty((0, SIMILAR_NUM_PERM), dtype=np.uint32),
+        )
+
+    @classmethod
+    def from_signatures(cls, ids, signatures):
+        bands = band_hashes(signatures)
+        order = np.argsort(bands, axis=0, kind='stable')
+        return cls(
+            ids, signatures,
+            np.ascontiguousarray(np.take_along_axis(bands, order, axis=0).T),
+            np.ascontiguousarray(order.T.astype(np.int32)),
+        )
+
+    @classmethod
+    def load(cls, directory):
+        """Загружает массивы индекса, отображая файлы в память."""
+        return cls(*(
+            np.load(Path(directory) / f'{name}.npy', mmap_mode='r')
+            for name in ARRAYS
+        ))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(Path(directory) / f'{name}.npy', getattr(self, name))
+
+    def find(self, recipe_id):
+        position = int(np.searchsorted(self.ids, recipe_id))
+        if position < len(self.ids) and self.ids[position] == recipe_id:
+            return position
+        return None
+
+    def candidates(self, query_bands):
+        """Строки рецептов, совпавших с запросом хотя бы в одной полосе."""
+        return np.unique(np.concatenate([
+            self.band_order[band, np.searchsorted(
+                self.band_sorted[band], value, 'left'
+            ):np.searchsorted(self.band_sorted[band], value, 'right')]
+            for band, value in enumerate(query_bands)
+        ]))
+
+    def rank(self, signature, excluded=()):
+        """
+        Кандидаты LSH для сигнатуры, кроме рецептов `excluded`, и оценки
+        их сходства — доли совпавших значений MinHash.
+        """
+        rows = self.candidates(band_hashes(signature[None, :])[0])
+        ids = np.asarray(self.ids[rows])
+        keep = ~np.isin(ids, excluded)
+        rows = rows[keep]
+        return ids[keep], (self.signatures[rows] == signature).mean(axis=1)
+
+
+def load_ingredient_sets(recipe_ids=None):
+    """
+    Наборы ингредиентов рецептов: id рецептов, начала наборов и id
+    ингредиентов, сгруппированные по рецептам.
+    """
+    pairs = IngredientRecipe.objects.order_by('recipe_id', 'ingredient_id')
+    if recipe_ids is not None:
+        pairs = pairs.filter(recipe_id__in=recipe_ids)
+    pairs = np.array(
+        list(pairs.values_list('recipe_id', 'ingredient_id').iterator()),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    ids, offsets = np.unique(pairs[:, 0], return_index=True)
+    return ids, offsets, pairs[:, 1]
+
+
+def rebuild_index():
+    """
+    Строит индекс по всем рецептам и атомарно переключает на него воркеры:
+    массивы записываются в новый каталог, после чего заменяется файл
+    CURRENT с именем каталога. Сигнатуры, учтенные в индексе, удаляются.
+    """
+    started = timezone.now()
+    ids, offsets, ingredient_ids = load_ingredient_sets()
+    data = IndexData.from_signatures(
+        ids, compute_signatures(offsets, ingredient_ids)
+    )
+    root = Path(settings.SIMILAR_INDEX_DIR)
+    name = str(time.time_ns())
+    data.save(root / name)
+    previous = _current_name(root)
+    with open(root / f'{CURRENT_FILE}.tmp', 'w') as current:
+        current.write(name)
+    os.replace(root / f'{CURRENT_FILE}.tmp', root / CURRENT_FILE)
+    for path in root.iterdir():
+        if path.is_dir() and path.name not in (name, previous):
+            shutil.rmtree(path, ignore_errors=True)
+    RecipeSignature.objects.filter(updated_at__lt=started).delete()
+    bump_version(SIMILAR_VERSION)
+    return data
+
+
+def _current_name(root):
+    try:
+        return (Path(root) / CURRENT_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def update_signatures(recipe_ids):
+    """
+    Пересчитывает сигнатуры рецептов с измененными ингредиентами. Рецепт
+    без ингредиентов получает пустую сигнатуру и исключается из выдачи.
+    """
+    recipe_ids = set(
+        Recipe.objects.filter(pk__in=recipe_ids).values_list('id', flat=True)
+    )
+    if not recipe_ids:
+        return
+    ids, offsets, ingredient_ids = load_ingredient_sets(recipe_ids)
+    signatures = dict(zip(
+        ids.tolist(), compute_signatures(offsets, ingredient_ids)
+    ))
+    RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+    RecipeSignature.objects.bulk_create(
+        RecipeSignature(
+            recipe_id=recipe_id,
+            signature=(
+                signatures[recipe_id].tobytes()
+                if recipe_id in signatures else b''
+            ),
+        )
+        for recipe_id in recipe_ids
+    )
+    bump_version(SIMILAR_VERSION)
+
+
+def _flush():
+    recipe_ids = getattr(_pending, 'recipe_ids', set())
+    _pending.recipe_ids = set()
+    update_signatures(recipe_ids)
+
+
+def schedule_signature_update(*recipe_ids):
+    """Откладывает пересчет сигнатур рецептов до фиксации транзакции."""
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(_flush)
+
+
+class SimilarRecipeIndex:
+    """
+    Индекс похожих рецептов в памяти процесса.
+
+    Основной индекс отображается в память из каталога, указанного в файле
+    CURRENT, и дополняется сигнатурами рецептов, измененных после его
+    построения. Индекс перечитывается при смене версии SIMILAR_VERSION или
+    содержимого файла CURRENT: новый индекс, построенный другим процессом,
+    подхватывается, даже если смена версии до процесса не дошла.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._base = IndexData.empty()
+        self._overlay = IndexData.empty()
+        self._changed = np.empty(0, dtype=np.int64)
+
+    def _load(self, state):
+        name = state[1]
+        base = IndexData.empty()
+        if name is not None:
+            base = IndexData.load(Path(settings.SIMILAR_INDEX_DIR) / name)
+        rows = list(RecipeSignature.objects.values_list(
+            'recipe_id', 'signature'
+        ))
+        indexed = [(pk, bytes(value)) for pk, value in rows if value]
+        overlay = IndexData.empty()
+        if indexed:
+            overlay = IndexData.from_signatures(
+                np.array([pk for pk, _ in indexed], dtype=np.int64),
+                np.frombuffer(
+                    b''.join(value for _, value in indexed), dtype=np.uint32
+                ).reshape(len(indexed), SIMILAR_NUM_PERM),
+            )
+        self._base, self._overlay = base, overlay
+        self._changed = np.array(
+            sorted(pk for pk, _ in rows), dtype=np.int64
+        )
+        self._state = state
+
+    def _ensure_loaded(self):
+        state = (
+            get_version(SIMILAR_VERSION),
+            _current_name(settings.SIMILAR_INDEX_DIR),
+        )
+        if state != self._state:
+            with self._lock:
+                if state != self._state:
+                    self._load(state)
+        return self._base, self._overlay, self._changed
+
+    def similar(self, recipe_id, limit):
+        """
+        Id рецептов с наибольшей оценкой сходства наборов ингредиентов
+        (доля совпавших значений MinHash), не более `limit` штук.
+        """
+        base, overlay, changed = self._ensure_loaded()
+        position = overlay.find(recipe_id)
+        if position is not None:
+            signature = overlay.signatures[position]
+        else:
+            position = base.find(recipe_id)
+            if position is None or recipe_id in changed:
+                return []
+            signature = base.signatures[position]
+        ids, scores = [], []
+        for data, excluded in ((base, changed), (overlay, ())):
+            data_ids, data_scores = data.rank(
+                signature, np.append(excluded, recipe_id)
+            )
+            ids.append(data_ids)
+            scores.append(data_scores)
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        return ids[np.lexsort((-ids, -scores))[:limit]].tolist()
+
+
+similar_index = SimilarRecipeIndex()
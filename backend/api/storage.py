@@ -0,0 +1,62 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, в котором имя файла — SHA-256 его содержимого:
+    `<каталог>/<первые два символа хэша>/<хэш><расширение>`.
+
+    Одинаковые файлы хранятся один раз: если файл с таким именем уже есть,
+    он не перезаписывается. Содержимое по имени никогда не меняется, поэтому
+    адреса файлов можно кэшировать бессрочно. Файлы не удаляются вместе с
+    объектами — неиспользуемые удаляет команда gc_images.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = posixpath.split(str(name).replace('\\', '/'))
+        extension = posixpath.splitext(filename)[1].lower()
+        return super().save(
+            posixpath.join(directory, digest[:2], f'{digest}{extension}'),
+            content, max_length,
+        )
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        """
+        Записывает файл под временным именем и атомарно переименовывает,
+        поэтому одновременная запись одинаковых файлов безопасна. У уже
+        существующего файла обновляется время изменения, чтобы gc_images
+        не удалил его, пока новая ссылка на него не сохранена.
+        """
+        try:
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                temporary = super()._save(
+                    f'{name}.{uuid.uuid4().hex}.tmp', content
+                )
+                os.replace(self.path(temporary), self.path(name))
+        finally:
+            if hasattr(content, 'temporary_file_path'):
+                # временный файл загрузки перемещен или не нужен: закрываем
+                # его сразу, а не при сборке мусора
+                content.close()
+        return name
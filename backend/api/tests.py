@@ -1,6 +1,44 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
-from django.test import Client, TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from api.cache import RECIPE_INGREDIENTS_VERSION, get_version
+from api.constants import ErrorMessage, POPULARITY_FULL_REFRESH_INTERVAL
+from api.pagination import cached_count
+from api.reference_tables import ingredient_table, tag_table
+from recipes.models import (
+    Favorite, ImageTask, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingListItem, Subscription, Tag
+)
+from recipes.popularity import refresh_popularity
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+TEMP_INDEX_DIR = tempfile.mkdtemp()
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
 
 
 class FoodgramAPITestCase(TestCase):
@@ -11,3 +49,731 @@ class FoodgramAPITestCase(TestCase):
         """Проверка доступности страницы с рецептами."""
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, SIMILAR_INDEX_DIR=TEMP_INDEX_DIR
+)
+class RecipeListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='Reader', last_name='Reader',
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Author', last_name='Author',
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color=f'#00000{index}', slug=f'tag{index}'
+            )
+            for index in range(3)
+        ]
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        cls.recipes = []
+        for index in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {index}', text='Описание',
+                cooking_time=10,
+                image=SimpleUploadedFile(
+                    'small.gif', SMALL_GIF, content_type='image/gif'
+                ),
+            )
+            recipe.tags.set(cls.tags)
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=5
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(TEMP_INDEX_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.user_client = Client(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}'
+        )
+
+    def test_user_flags(self):
+        """Признаки избранного и списка покупок отдаются для пользователя."""
+        response = self.user_client.get('/api/recipes/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        flags = {
+            item['id']: (item['is_favorited'], item['is_in_shopping_cart'])
+            for item in response.json()['results']
+        }
+        self.assertEqual(flags[self.recipes[0].id], (True, False))
+        self.assertEqual(flags[self.recipes[1].id], (False, True))
+        self.assertEqual(flags[self.recipes[2].id], (False, False))
+
+    def test_user_flags_for_guest(self):
+        """Для анонимного пользователя признаки всегда ложны."""
+        response = self.guest_client.get('/api/recipes/')
+        for item in response.json()['results']:
+            self.assertFalse(item['is_favorited'])
+            self.assertFalse(item['is_in_shopping_cart'])
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        """Число запросов к БД не зависит от размера страницы."""
+        with self.assertNumQueries(5):
+            self.guest_client.get('/api/recipes/?limit=1')
+        cache.clear()
+        with self.assertNumQueries(5):
+            self.guest_client.get('/api/recipes/?limit=3')
+
+    def test_cached_count(self):
+        """Число рецептов берется из кэша и сбрасывается при изменениях."""
+        self.guest_client.get('/api/recipes/')
+        with self.assertNumQueries(2):
+            response = self.guest_client.get('/api/recipes/?page=1')
+        self.assertEqual(response.json()['count'], len(self.recipes))
+        Favorite.objects.create(user=self.author, recipe=self.recipes[2])
+        with self.assertNumQueries(0):
+            cached_count(Recipe.objects.with_user_flags(self.user))
+        self.recipes[2].delete()
+        response = self.guest_client.get('/api/recipes/')
+        self.assertEqual(response.json()['count'], len(self.recipes) - 1)
+
+    def test_cursor_pagination(self):
+        """Пагинация по курсору обходит все рецепты без подсчета."""
+        response = self.guest_client.get('/api/recipes/?cursor=&limit=2')
+        data = response.json()
+        self.assertNotIn('count', data)
+        ids = [item['id'] for item in data['results']]
+        response = self.guest_client.get(data['next'])
+        ids += [item['id'] for item in response.json()['results']]
+        self.assertEqual(
+            ids, [recipe.id for recipe in reversed(self.recipes)]
+        )
+
+    def test_representation_cache_invalidation(self):
+        """Кэш представления рецепта сбрасывается при изменении рецепта."""
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        self.guest_client.get(url)
+        with self.assertNumQueries(2):
+            self.guest_client.get(url)
+        IngredientRecipe.objects.filter(recipe=self.recipes[0]).update(
+            amount=7
+        )
+        IngredientRecipe.objects.get(recipe=self.recipes[0]).save()
+        response = self.user_client.get(url)
+        self.assertEqual(response.json()['ingredients'][0]['amount'], 7)
+        self.assertTrue(response.json()['is_favorited'])
+
+    def test_favorites_counter(self):
+        """Счетчик добавлений в избранное меняется вместе со связью."""
+        recipe = self.recipes[2]
+        url = f'/api/recipes/{recipe.id}/favorite/'
+        self.user_client.post(url)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.user_client.delete(url)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        # связь из фикстуры создана через ORM, а удаляется через API
+        self.user_client.delete(f'/api/recipes/{self.recipes[0].id}/favorite/')
+        self.recipes[0].refresh_from_db()
+        self.assertEqual(self.recipes[0].favorites_count, 0)
+        Favorite.objects.create(user=self.author, recipe=recipe)
+        Recipe.objects.filter(pk=recipe.pk).update(favorites_count=0)
+        Favorite.objects.filter(recipe=recipe).delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+    def test_tags_filter_without_duplicates(self):
+        """Рецепт с несколькими выбранными тегами возвращается один раз."""
+        query = '&'.join(f'tags={tag.slug}' for tag in self.tags)
+        response = self.guest_client.get(f'/api/recipes/?{query}')
+        ids = [item['id'] for item in response.json()['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(response.json()['count'], len(self.recipes))
+
+    def test_tags_filter_query_count(self):
+        """Число запросов не зависит от количества выбранных тегов."""
+        self.guest_client.get('/api/recipes/')
+        with self.assertNumQueries(4):
+            self.guest_client.get(f'/api/recipes/?tags={self.tags[0].slug}')
+        query = '&'.join(f'tags={tag.slug}' for tag in self.tags)
+        with self.assertNumQueries(4):
+            self.guest_client.get(f'/api/recipes/?{query}')
+
+    def test_search(self):
+        """Поиск находит рецепты по названию, описанию и ингредиентам."""
+        call_command('rebuild_search_index', stdout=StringIO())
+        recipe = self.recipes[1]
+        recipe.text = 'Томатный суп с базиликом'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        response = self.guest_client.get('/api/recipes/?search=базилик')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']], [recipe.id]
+        )
+        response = self.guest_client.get(
+            '/api/recipes/?search=базилик&cursor='
+        )
+        self.assertIn('count', response.json())
+        response = self.guest_client.get('/api/recipes/?search=соль')
+        self.assertEqual(response.json()['count'], len(self.recipes))
+
+    def test_ingredient_autocomplete(self):
+        """Автодополнение ингредиентов работает без обращений к БД."""
+        Ingredient.objects.create(name='Морская соль', measurement_unit='г')
+        Ingredient.objects.create(name='Сода', measurement_unit='г')
+        self.guest_client.get('/api/ingredients/?name=с')
+        with self.assertNumQueries(0):
+            response = self.guest_client.get('/api/ingredients/?name=СО')
+        self.assertEqual(
+            [item['name'] for item in response.json()],
+            ['Сода', 'Соль', 'Морская соль']
+        )
+        response = self.guest_client.get('/api/ingredients/?name=')
+        self.assertEqual(len(response.json()), Ingredient.objects.count())
+
+    def test_tags_conditional_get(self):
+        """Неизменившийся список тегов отдается ответом 304."""
+        response = self.guest_client.get('/api/tags/')
+        etag = response['ETag']
+        response = self.guest_client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        response = self.guest_client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+    def test_recipe_conditional_get(self):
+        """Неизменившийся рецепт отдается ответом 304 без сериализации."""
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        etag = self.user_client.get(url)['ETag']
+        with self.assertNumQueries(2):
+            response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Favorite.objects.filter(user=self.user).delete()
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        etag = response['ETag']
+        self.recipes[0].tags.remove(self.tags[0])
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_recipe_list_conditional_get(self):
+        """Неизменившаяся страница рецептов отдается анониму ответом 304."""
+        etag = self.guest_client.get('/api/recipes/')['ETag']
+        response = self.guest_client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.recipes[2].delete()
+        response = self.guest_client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_download_shopping_cart(self):
+        """Список покупок выгружается в разных форматах и кэшируется."""
+        url = '/api/recipes/download_shopping_cart/'
+        response = self.user_client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'Список покупок:\n- Соль (г) - 5'
+        )
+        with self.assertNumQueries(1):
+            response = self.user_client.get(url)
+            b''.join(response.streaming_content)
+        response = self.user_client.get(f'{url}?format=json')
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            [{'name': 'Соль', 'measurement_unit': 'г', 'amount': 5}]
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[2])
+        response = self.user_client.get(f'{url}?format=csv')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['name,measurement_unit,amount', 'Соль,г,10']
+        )
+
+    def test_shopping_list_aggregate(self):
+        """Агрегированный Список покупок следует за корзиной и рецептами."""
+        url = '/api/recipes/shopping_list/'
+        self.assertEqual(self.user_client.get(url).json(), [{
+            'id': self.ingredient.id, 'name': 'Соль',
+            'measurement_unit': 'г', 'amount': 5,
+        }])
+        self.user_client.post(
+            f'/api/recipes/{self.recipes[2].id}/shopping_cart/'
+        )
+        item = IngredientRecipe.objects.get(recipe=self.recipes[1])
+        item.amount = 7
+        item.save()
+        self.assertEqual(self.user_client.get(url).json()[0]['amount'], 12)
+        self.recipes[2].delete()
+        self.assertEqual(self.user_client.get(url).json()[0]['amount'], 7)
+        ShoppingListItem.objects.all().delete()
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(self.user_client.get(url).json()[0]['amount'], 7)
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertEqual(self.user_client.get(url).json(), [])
+        for recipe in self.recipes[:2]:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        pepper = Ingredient.objects.create(name='Перец', measurement_unit='г')
+        token = Token.objects.create(user=self.author)
+        Client(HTTP_AUTHORIZATION=f'Token {token}').patch(
+            f'/api/recipes/{self.recipes[1].id}/',
+            self.recipe_payload('Рецепт 1', [(pepper, 4)], self.tags),
+            content_type='application/json',
+        )
+        self.assertEqual(
+            [(item['name'], item['amount'])
+             for item in self.user_client.get(url).json()],
+            [('Перец', 4), ('Соль', 5)]
+        )
+
+    def test_subscriptions_query_count(self):
+        """Подписки с рецептами авторов загружаются за 4 запроса."""
+        Subscription.objects.create(user=self.user, author=self.author)
+        url = '/api/users/subscriptions/?recipes_limit=2'
+        with self.assertNumQueries(4):
+            response = self.user_client.get(url)
+        author = response.json()['results'][0]
+        self.assertTrue(author['is_subscribed'])
+        self.assertEqual(author['recipes_count'], len(self.recipes))
+        self.assertEqual(
+            [recipe['id'] for recipe in author['recipes']],
+            [self.recipes[2].id, self.recipes[1].id]
+        )
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass',
+        )
+        Subscription.objects.create(user=self.user, author=other)
+        with self.assertNumQueries(3):
+            response = self.user_client.get(f'{url}&cursor=')
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_users_is_subscribed_query_count(self):
+        """Признак подписки для списка пользователей загружается один раз."""
+        Subscription.objects.create(user=self.user, author=self.author)
+        with self.assertNumQueries(4):
+            self.user_client.get('/api/users/?limit=1')
+        with self.assertNumQueries(4):
+            response = self.user_client.get('/api/users/?limit=2')
+        flags = {
+            item['id']: item['is_subscribed']
+            for item in response.json()['results']
+        }
+        self.assertEqual(flags, {self.user.id: False, self.author.id: True})
+
+    def test_feed_strategies(self):
+        """Лента подписок одинакова для стратегий fan_in и fan_out."""
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass',
+        )
+        Recipe.objects.create(
+            author=other, name='Чужой', text='Описание', cooking_time=10,
+            image='recipes/other.gif',
+        )
+        expected = [recipe.id for recipe in reversed(self.recipes)]
+        for strategy in ('fan_in', 'fan_out'):
+            with self.subTest(strategy=strategy), override_settings(
+                FEED_STRATEGY=strategy
+            ):
+                subscription = Subscription.objects.create(
+                    user=self.user, author=self.author
+                )
+                response = self.user_client.get('/api/recipes/feed/?limit=2')
+                data = response.json()
+                ids = [item['id'] for item in data['results']]
+                ids += [
+                    item['id']
+                    for item in self.user_client.get(data['next']).json()[
+                        'results'
+                    ]
+                ]
+                self.assertEqual(ids, expected)
+                subscription.delete()
+                response = self.user_client.get('/api/recipes/feed/')
+                self.assertEqual(response.json()['results'], [])
+
+    def test_popular(self):
+        """Популярные рецепты берутся из рейтинга и фильтруются по тегам."""
+        call_command('refresh_popularity', stdout=StringIO())
+        response = self.guest_client.get('/api/recipes/popular/?period=day')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.recipes[0].id, self.recipes[1].id]
+        )
+        Favorite.objects.create(user=self.author, recipe=self.recipes[1])
+        ShoppingCart.objects.create(user=self.author, recipe=self.recipes[2])
+        call_command('refresh_popularity', stdout=StringIO())
+        for url in (
+            '/api/recipes/popular/?period=all',
+            '/api/recipes/popular/?period=all&cursor=',
+        ):
+            response = self.guest_client.get(url)
+            self.assertEqual(
+                [item['id'] for item in response.json()['results']],
+                [self.recipes[1].id, self.recipes[0].id, self.recipes[2].id]
+            )
+        # удаленное добавление учитывается при полном пересчете
+        Favorite.objects.filter(user=self.author).delete()
+        refresh_popularity(now=timezone.now() + timedelta(
+            seconds=POPULARITY_FULL_REFRESH_INTERVAL
+        ))
+        response = self.guest_client.get('/api/recipes/popular/?period=all')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.recipes[0].id, self.recipes[2].id, self.recipes[1].id]
+        )
+        self.recipes[1].tags.remove(self.tags[0])
+        response = self.guest_client.get(
+            f'/api/recipes/popular/?tags={self.tags[0].slug}'
+        )
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.recipes[0].id, self.recipes[2].id]
+        )
+        response = self.guest_client.get('/api/recipes/popular/?period=year')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_similar_recipes(self):
+        """Похожие рецепты ищутся по индексу с учетом новых изменений."""
+        pepper = Ingredient.objects.create(name='Перец', measurement_unit='г')
+        IngredientRecipe.objects.create(
+            recipe=self.recipes[2], ingredient=pepper, amount=1
+        )
+        url = f'/api/recipes/{self.recipes[0].id}/similar/'
+        self.assertEqual(self.guest_client.get(url).json(), [])
+        # индекс строит другой процесс: смена версии может не дойти
+        with mock.patch('api.similar_index.bump_version'):
+            call_command('rebuild_similar_index', stdout=StringIO())
+        self.assertEqual(
+            [item['id'] for item in self.guest_client.get(url).json()],
+            [self.recipes[1].id, self.recipes[2].id]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.filter(recipe=self.recipes[1]).delete()
+        self.assertEqual(
+            [item['id'] for item in self.guest_client.get(url).json()],
+            [self.recipes[2].id]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.create(
+                recipe=self.recipes[1], ingredient=self.ingredient, amount=1
+            )
+        self.assertEqual(
+            [item['id'] for item in self.guest_client.get(url).json()],
+            [self.recipes[1].id, self.recipes[2].id]
+        )
+
+    def test_recipes_by_ingredients(self):
+        """Рецепты подбираются по имеющимся ингредиентам и тегам."""
+        pepper = Ingredient.objects.create(name='Перец', measurement_unit='г')
+        with self.captureOnCommitCallbacks() as callbacks:
+            IngredientRecipe.objects.create(
+                recipe=self.recipes[2], ingredient=pepper, amount=1
+            )
+        # индекс, построенный до фиксации, сбрасывается после нее
+        version = get_version(RECIPE_INGREDIENTS_VERSION)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_version(RECIPE_INGREDIENTS_VERSION), version)
+        url = f'/api/recipes/by_ingredients/?ids={self.ingredient.id}'
+        response = self.guest_client.get(url)
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.recipes[1].id, self.recipes[0].id]
+        )
+        response = self.guest_client.get(f'{url}&missing=1&cursor=')
+        self.assertEqual(response.json()['count'], len(self.recipes))
+        self.assertEqual(
+            response.json()['results'][-1]['id'], self.recipes[2].id
+        )
+        self.recipes[1].tags.remove(self.tags[0])
+        response = self.guest_client.get(
+            f'{url}&missing=1&tags={self.tags[0].slug}&limit=1'
+        )
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(
+            response.json()['results'][0]['id'], self.recipes[0].id
+        )
+        response = self.guest_client.get(f'{url}&missing=-1')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def recipe_payload(self, name, ingredients, tags):
+        return {
+            'name': name, 'text': 'Описание', 'cooking_time': 5,
+            'image': (
+                'data:image/gif;base64,' + base64.b64encode(SMALL_GIF).decode()
+            ),
+            'tags': [tag.id for tag in tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient, amount in ingredients
+            ],
+        }
+
+    def test_recipe_write_query_count(self):
+        """Рецепт записывается фиксированным числом запросов."""
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}',
+                                      measurement_unit='г')
+            for index in range(30)
+        ]
+        token = Token.objects.create(user=self.author)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        tag_table.in_bulk(())
+        ingredient_table.in_bulk(())
+        counts = []
+        recipe_ids = []
+        for size in (2, 30):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(
+                    '/api/recipes/',
+                    self.recipe_payload(
+                        f'Новый {size}',
+                        [(item, 1) for item in ingredients[:size]],
+                        self.tags,
+                    ),
+                    content_type='application/json',
+                )
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+            counts.append(len(queries))
+            recipe_ids.append(response.json()['id'])
+        self.assertEqual(counts[0], counts[1])
+        recipe_id = response.json()['id']
+        rows = dict(IngredientRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'id'))
+        response = client.patch(
+            f'/api/recipes/{recipe_id}/',
+            self.recipe_payload(
+                'Новый 30',
+                [(item, 1) for item in ingredients[1:30]]
+                + [(ingredients[0], 2), (self.ingredient, 3)],
+                self.tags[1:],
+            ),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            {item['id']: item['amount']
+             for item in response.json()['ingredients']},
+            {**{item.id: 1 for item in ingredients[1:]},
+             ingredients[0].id: 2, self.ingredient.id: 3}
+        )
+        self.assertEqual(
+            [tag['id'] for tag in response.json()['tags']],
+            [tag.id for tag in self.tags[1:]]
+        )
+        new_rows = dict(IngredientRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'id'))
+        self.assertEqual(
+            {pk: new_rows[pk] for pk in rows}, rows
+        )
+        counts = []
+        for recipe_id, name, amount, tags in (
+            (recipe_ids[0], 'Новый 2', 1, self.tags),
+            (recipe_ids[1], 'Новый 30', 2, self.tags[1:]),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.patch(
+                    f'/api/recipes/{recipe_id}/',
+                    self.recipe_payload(
+                        name, [(ingredients[0], amount)], tags
+                    ),
+                    content_type='application/json',
+                )
+            self.assertEqual(len(response.json()['ingredients']), 1)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        payload = self.recipe_payload(
+            'Новый 0', [(self.ingredient, 1)], self.tags
+        )
+        payload['ingredients'].append({'id': 0, 'amount': 1})
+        response = client.post(
+            '/api/recipes/', payload, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            response.json()['ingredients'][1]['id'],
+            [PrimaryKeyRelatedField.default_error_messages[
+                'does_not_exist'
+            ].format(pk_value=0)]
+        )
+
+    def test_shopping_cart_batch(self):
+        """Массовое добавление и удаление рецептов в Списке покупок."""
+        url = '/api/recipes/shopping_cart/'
+        ids = [recipe.id for recipe in self.recipes] + [0]
+        response = self.user_client.post(
+            url, {'ids': ids}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            [item['status'] for item in response.json()],
+            ['added', 'exists', 'added', 'not_found']
+        )
+        self.assertEqual(
+            self.user_client.get('/api/recipes/shopping_list/').json()[0][
+                'amount'
+            ], 15
+        )
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[0].id).shopping_cart_count, 1
+        )
+        response = self.user_client.delete(
+            f'{url}?ids={self.recipes[0].id},{self.recipes[1].id},0'
+        )
+        self.assertEqual(
+            [item['status'] for item in response.json()],
+            ['removed', 'removed', 'not_found']
+        )
+        self.assertEqual(
+            self.user_client.get('/api/recipes/shopping_list/').json()[0][
+                'amount'
+            ], 5
+        )
+        ids = [recipe.id for recipe in self.recipes]
+        self.user_client.post(
+            url, {'ids': ids}, content_type='application/json'
+        )
+        counts = []
+        for chunk in (ids[:1], ids[1:]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.user_client.delete(
+                    f'{url}?ids={",".join(map(str, chunk))}'
+                )
+            self.assertEqual(
+                {item['status'] for item in response.json()}, {'removed'}
+            )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(
+            [recipe.shopping_cart_count for recipe in Recipe.objects.filter(
+                pk__in=ids
+            )],
+            [0, 0, 0]
+        )
+        response = self.user_client.post(
+            '/api/users/subscribe/',
+            {'ids': [self.author.id, self.user.id]},
+            content_type='application/json',
+        )
+        self.assertEqual(
+            [item['status'] for item in response.json()],
+            ['added', 'forbidden']
+        )
+        self.assertTrue(Subscription.objects.filter(
+            user=self.user, author=self.author
+        ).exists())
+        response = self.user_client.post(
+            url, {'ids': 'x'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_image_variants(self):
+        """Варианты картинки строятся обработчиком очереди."""
+        token = Token.objects.create(user=self.author)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        response = client.post(
+            '/api/recipes/',
+            self.recipe_payload(
+                'С картинкой', [(self.ingredient, 1)], self.tags
+            ),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        recipe_id = response.json()['id']
+        images = response.json()['images']
+        self.assertEqual(set(images.values()), {response.json()['image']})
+        self.assertEqual(ImageTask.objects.filter(
+            recipe_id=recipe_id
+        ).count(), 1)
+        self.user_client.get(f'/api/recipes/{recipe_id}/')
+        # обработчик — отдельный процесс: сброс версий может не дойти
+        with mock.patch('api.image_pipeline.invalidate_recipes'):
+            call_command('process_images', '--once', stdout=StringIO())
+        self.assertFalse(ImageTask.objects.exists())
+        recipe = Recipe.objects.get(pk=recipe_id)
+        self.assertEqual(set(recipe.image_variants), set(images))
+        images = self.user_client.get(
+            f'/api/recipes/{recipe_id}/'
+        ).json()['images']
+        self.assertTrue(images['small_webp'].endswith('.webp'))
+        self.assertTrue(recipe.image.storage.exists(
+            recipe.image_variants['large']
+        ))
+
+    def test_content_addressed_images(self):
+        """Одинаковые картинки хранятся один раз, лишние удаляет gc_images."""
+        storage = self.recipes[0].image.storage
+        self.assertEqual(
+            {recipe.image.name for recipe in self.recipes},
+            {self.recipes[0].image.name}
+        )
+        self.assertRegex(
+            self.recipes[0].image.name, r'^recipes/images/\w{2}/\w{64}\.gif$'
+        )
+        orphan = storage.save(
+            'recipes/images/orphan.gif', ContentFile(SMALL_GIF + b'\0')
+        )
+        os.utime(storage.path(orphan), (0, 0))
+        output = StringIO()
+        call_command('gc_images', '--dry-run', stdout=output)
+        self.assertIn(orphan, output.getvalue())
+        storage.save('recipes/images/copy.gif', ContentFile(SMALL_GIF + b'\0'))
+        output = StringIO()
+        call_command('gc_images', '--dry-run', stdout=output)
+        self.assertNotIn(orphan, output.getvalue())
+        output = StringIO()
+        call_command('gc_images', '--dry-run', '--grace', '0', stdout=output)
+        self.assertIn(orphan, output.getvalue())
+        self.assertTrue(storage.exists(orphan))
+        call_command('gc_images', '--grace', '0', stdout=StringIO())
+        self.assertFalse(storage.exists(orphan))
+        self.assertTrue(storage.exists(self.recipes[0].image.name))
+
+    def test_multipart_upload(self):
+        """Рецепт создается multipart-запросом с картинкой отдельным файлом."""
+        token = Token.objects.create(user=self.author)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        payload = self.recipe_payload(
+            'Multipart', [(self.ingredient, 1)], self.tags
+        )
+        del payload['image']
+        response = client.post('/api/recipes/', {
+            'data': json.dumps(payload),
+            'image': SimpleUploadedFile(
+                'small.gif', SMALL_GIF, content_type='image/gif'
+            ),
+        })
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(
+            Recipe.objects.get(pk=response.json()['id']).image.name,
+            self.recipes[0].image.name
+        )
+        with mock.patch('api.serializers.RECIPE_IMAGE_MAX_SIZE', 10):
+            response = client.post(
+                '/api/recipes/',
+                self.recipe_payload(
+                    'Большая', [(self.ingredient, 1)], self.tags
+                ),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            response.json()['image'], [ErrorMessage.IMAGE_TOO_LARGE]
+        )
@@ -2,8 +2,9 @@ from django.urls import include, path
 from rest_framework import routers
 
 from api.views import (
-    FavoriteViewSet, IngredientViewSet, RecipeViewSet, ShoppingCartViewSet,
-    SubscribtionViewSet, TagViewSet
+    CacheMetricsView, FavoriteBatchView, FavoriteViewSet, IngredientViewSet,
+    RecipeViewSet, ShoppingCartBatchView, ShoppingCartViewSet,
+    SubscribtionViewSet, SubscriptionBatchView, TagViewSet
 )
 
 
@@ -27,6 +28,18 @@ router.register('recipes', RecipeViewSet)
 router.register('tags', TagViewSet)
 router.register('ingredients', IngredientViewSet)
 urlpatterns = [
+    path('metrics/', CacheMetricsView.as_view(), name='metrics'),
+    path(
+        'recipes/shopping_cart/', ShoppingCartBatchView.as_view(),
+        name='shopping_cart_batch'
+    ),
+    path(
+        'recipes/favorite/', FavoriteBatchView.as_view(), name='favorite_batch'
+    ),
+    path(
+        'users/subscribe/', SubscriptionBatchView.as_view(),
+        name='subscribe_batch'
+    ),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,27 +1,50 @@
 from django_filters.rest_framework import DjangoFilterBackend
 
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Count, F, Max
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from api.cache import (
+    CART_VERSION, INGREDIENTS_VERSION, POPULARITY_VERSION, TAGS_VERSION,
+    get_version, get_versions
+)
 from api.constants import (
-    SHOPPING_LIST_FILE_CONTENT_TYPE, SHOPPING_LIST_FILE_NAME, HTTPMethod
+    BATCH_MAX_SIZE, COUNT_STRATEGY_CACHED, INGREDIENT_SEARCH_LIMIT,
+    POPULARITY_PERIOD_DEFAULT, RECIPE_CACHE_CONTROL,
+    SHOPPING_LIST_CACHE_TIMEOUT, SHOPPING_LIST_FILE_NAME,
+    SIMILAR_RECIPES_LIMIT, ErrorMessage, HTTPMethod
 )
 from api.filters import IngredientFilter, RecipeFilter
+from api.ingredient_index import ingredient_index
+from api.metrics import get_metrics, increment
+from api.mixins import (
+    VersionedCacheMixin, conditional_response, make_etag
+)
+from api.pagination import LimitCursorPagination, ListPagination
+from api.parsers import MultiPartJSONParser
 from api.permissions import IsAuthorChangeRecipePermission
+from api.recipe_ingredient_index import recipe_ingredient_index
+from api.renderers import SHOPPING_LIST_RENDERERS, FormatContentNegotiation
 from api.serializers import (
     FavoriteSerializer, IngredientSerializer, RecipeCreateUpdateSerializer,
-    RecipeSerializer, ShoppingCartSerializer, SubscribtionSerializer,
-    TagSerializer
+    RecipeSerializer, ShoppingCartSerializer, ShoppingListItemSerializer,
+    SubscribtionSerializer, TagSerializer, UserWithRecipeSerializer
 )
+from api.signals import relations_bulk_created, relations_bulk_deleted
+from api.similar_index import similar_index
+from recipes.feed import feed_queryset
 from recipes.models import (
-    Ingredient, IngredientRecipe, Favorite, Recipe, ShoppingCart, Subscription,
-    Tag
+    Ingredient, Favorite, PopularityCheckpoint, Recipe, RecipePopularity,
+    ShoppingCart, Subscription, Tag
 )
 
 User = get_user_model()
@@ -29,8 +52,19 @@ User = get_user_model()
 
 class CreateDestroyViewSet(mixins.CreateModelMixin, mixins.DestroyModelMixin,
                            viewsets.GenericViewSet):
-    """Базовый класс вьюсета для создания и удаления объекта"""
-    pass
+    """
+    Базовый класс вьюсета для создания и удаления объекта. Связь и
+    зависящие от нее счетчики и Списки покупок (обработчики сигналов)
+    записываются в одной транзакции.
+    """
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -45,6 +79,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
+    parser_classes = (JSONParser, MultiPartJSONParser)
+    cursor_ordering = ('-pub_date', '-id',)
+    cursor_excluded_params = ('search',)
+    count_strategy = COUNT_STRATEGY_CACHED
+
+    def get_queryset(self):
+        return Recipe.objects.select_related('author').with_user_flags(
+            self.request.user
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -54,50 +97,259 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeSerializer
         return RecipeCreateUpdateSerializer
 
+    def representation_etag(self, *parts):
+        versions = get_versions(TAGS_VERSION, INGREDIENTS_VERSION)
+        return make_etag(
+            *parts, versions[TAGS_VERSION], versions[INGREDIENTS_VERSION],
+            self.request.accepted_renderer.format,
+            self.request.build_absolute_uri('/'),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        ETag рецепта вычисляется по дате его изменения и признакам читателя
+        одним легким запросом до построения сериализатора.
+        """
+        try:
+            state = self.get_queryset().filter(
+                pk=kwargs[self.lookup_field]
+            ).with_author_subscription(request.user).values_list(
+                'updated_at', 'is_favorited', 'is_in_shopping_cart',
+                'is_subscribed',
+            ).first()
+        except (TypeError, ValueError):
+            state = None
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.representation_etag(kwargs[self.lookup_field], *state)
+        return conditional_response(
+            request, etag, RECIPE_CACHE_CONTROL, super().retrieve,
+            *args, **kwargs
+        )
+
+    def list(self, request, *args, **kwargs):
+        """
+        Для анонимных пользователей ETag страницы вычисляется по последней
+        дате изменения и количеству рецептов отфильтрованной выборки.
+        """
+        return self.conditional_list(
+            request, self.filter_queryset(self.get_queryset())
+        )
+
+    def conditional_list(self, request, queryset, *parts):
+        if request.user.is_authenticated:
+            return self.list_queryset(request, queryset)
+        state = queryset.aggregate(
+            last_modified=Max('updated_at'), total=Count('id')
+        )
+        etag = self.representation_etag(
+            state['last_modified'], state['total'], request.get_full_path(),
+            *parts
+        )
+        return conditional_response(
+            request, etag, RECIPE_CACHE_CONTROL, self.list_queryset, queryset
+        )
+
+    def list_queryset(self, request, queryset):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
     @action(methods=(HTTPMethod.get,), detail=False,
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=SHOPPING_LIST_RENDERERS,
+            content_negotiation_class=FormatContentNegotiation)
     def download_shopping_cart(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).order_by('ingredient__name').annotate(total_amount=Sum('amount'))
-        content = 'Список покупок:'
-        ingredient_list = []
-        for ingredient in ingredients:
-            ingredient_name = ingredient['ingredient__name']
-            ingredient_unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['total_amount']
-            ingredient_list.append(
-                f'- {ingredient_name} ({ingredient_unit}) - {amount}'
-            )
-        if ingredient_list:
-            content += '\n' + '\n'.join(ingredient_list)
+        """
+        Файл Списка покупок в формате `?format=txt|csv|json`. Файл отдается
+        потоком и кэшируется до изменения Списка покупок пользователя.
+        """
+        renderer = request.accepted_renderer
+        versions = get_versions(
+            CART_VERSION.format(request.user.id), INGREDIENTS_VERSION
+        )
+        key = 'shopping-list:{}:{}:{}:{}'.format(
+            request.user.id, versions[CART_VERSION.format(request.user.id)],
+            versions[INGREDIENTS_VERSION], renderer.format,
+        )
+        content = cache.get(key)
+        if content is not None:
+            increment('shopping_list', 'hit')
+            chunks = (content,)
         else:
-            content += '\nВ Списке покупок отсутствуют рецепты.'
-        response = HttpResponse(
-            content, content_type=SHOPPING_LIST_FILE_CONTENT_TYPE
+            increment('shopping_list', 'miss')
+            chunks = self.render_shopping_list(renderer, key)
+        response = StreamingHttpResponse(
+            chunks,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
         )
+        file_name = SHOPPING_LIST_FILE_NAME.format(renderer.format)
         response['Content-Disposition'] = (
-            f'attachment; filename="{SHOPPING_LIST_FILE_NAME}"'
+            f'attachment; filename="{file_name}"'
         )
         return response
 
+    @action(methods=(HTTPMethod.get,), detail=True)
+    def similar(self, request, pk=None):
+        """
+        Рецепты с наиболее похожим набором ингредиентов (`?limit=`) по
+        индексу MinHash/LSH.
+        """
+        recipe = self.get_object()
+        try:
+            limit = int(request.query_params.get(
+                'limit', SIMILAR_RECIPES_LIMIT
+            ))
+        except ValueError:
+            limit = SIMILAR_RECIPES_LIMIT
+        ids = similar_index.similar(recipe.id, max(limit, 0))
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        )
+        return Response(serializer.data)
+
+    @action(methods=(HTTPMethod.get,), detail=False)
+    def by_ingredients(self, request):
+        """
+        Рецепты, которые можно приготовить из ингредиентов `?ids=1,2,3`,
+        если недостает не более `?missing=k` ингредиентов. Рецепты
+        упорядочены по числу недостающих ингредиентов.
+        """
+        try:
+            ingredient_ids = [
+                int(value)
+                for values in request.query_params.getlist('ids')
+                for value in values.split(',') if value
+            ]
+        except ValueError:
+            raise ValidationError({'ids': ErrorMessage.INGREDIENT_IDS_TYPE})
+        try:
+            missing = int(request.query_params.get('missing', 0))
+        except ValueError:
+            missing = -1
+        if missing < 0:
+            raise ValidationError({'missing': ErrorMessage.MISSING_TYPE})
+        ids = recipe_ingredient_index.search(ingredient_ids, missing)
+        if ids and set(request.query_params) & set(RecipeFilter.base_filters):
+            allowed = set(self.filter_queryset(self.get_queryset()).filter(
+                pk__in=ids
+            ).values_list('id', flat=True))
+            ids = [pk for pk in ids if pk in allowed]
+        paginator = ListPagination()
+        page = paginator.paginate_queryset(ids, request, self)
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=(HTTPMethod.get,), detail=False)
+    def popular(self, request):
+        """
+        Рецепты по убыванию популярности за период `?period=day|week|all`
+        из предрассчитанного рейтинга. Поддерживает фильтр по тегам.
+        """
+        period = request.query_params.get('period', POPULARITY_PERIOD_DEFAULT)
+        periods = dict(RecipePopularity.PERIODS)
+        if period not in periods:
+            raise ValidationError({
+                'period': ErrorMessage.POPULARITY_PERIOD.format(
+                    ', '.join(periods)
+                )
+            })
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            popularity__period=period
+        ).annotate(
+            popularity_score=F('popularity__score')
+        ).order_by('-popularity_score', '-id')
+        # время пересчета из базы: версия в кэше другого процесса (команды
+        # refresh_popularity) может быть не видна
+        computed_at = PopularityCheckpoint.objects.aggregate(
+            computed_at=Max('computed_at')
+        )['computed_at']
+        return self.conditional_list(
+            request, queryset, get_version(POPULARITY_VERSION), computed_at
+        )
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(methods=(HTTPMethod.get,), detail=False,
+            permission_classes=(permissions.IsAuthenticated,))
+    def feed(self, request):
+        """
+        Лента рецептов авторов из Подписок, от новых к старым, с пагинацией
+        по курсору. Стратегия построения задается настройкой FEED_STRATEGY.
+        """
+        queryset = self.filter_queryset(
+            feed_queryset(request.user, self.get_queryset())
+        )
+        paginator = LimitCursorPagination()
+        paginator.ordering = self.cursor_ordering
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=(HTTPMethod.get,), detail=False,
+            permission_classes=(permissions.IsAuthenticated,))
+    def shopping_list(self, request):
+        """Список покупок пользователя для предпросмотра."""
+        items = request.user.shopping_list.select_related(
+            'ingredient'
+        ).order_by('ingredient__name')
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
+    def get_shopping_list(self):
+        ingredients = self.request.user.shopping_list.values(
+            'ingredient__name', 'ingredient__measurement_unit', 'total_amount'
+        ).order_by('ingredient__name')
+        for ingredient in ingredients.iterator():
+            yield {
+                'name': ingredient['ingredient__name'],
+                'measurement_unit': ingredient['ingredient__measurement_unit'],
+                'amount': ingredient['total_amount'],
+            }
+
+    def render_shopping_list(self, renderer, key):
+        chunks = []
+        for chunk in renderer.render_rows(self.get_shopping_list()):
+            chunks.append(chunk)
+            yield chunk
+        cache.set(key, ''.join(chunks), SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+class TagViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для отображения тегов"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    cache_version_name = TAGS_VERSION
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для отображения ингредиентов"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientFilter
+    cache_version_name = INGREDIENTS_VERSION
+
+    def list(self, request, *args, **kwargs):
+        # пустой `name` — полный список, как без поиска
+        if not request.query_params.get('name'):
+            return super().list(request, *args, **kwargs)
+        return self.versioned_response(request, self.search, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        """
+        Поиск по названию обслуживается индексом в памяти процесса: сначала
+        совпадения по началу названия, затем по его части.
+        """
+        return Response(ingredient_index.search(
+            request.query_params['name'], limit=INGREDIENT_SEARCH_LIMIT
+        ))
 
 
 class FavoriteViewSet(CreateDestroyViewSet):
@@ -158,6 +410,8 @@ class SubscribtionViewSet(CreateDestroyViewSet, mixins.ListModelMixin):
     """Вьюсет для добавления, удаления авторов в Подписки"""
     serializer_class = SubscribtionSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    count_strategy = COUNT_STRATEGY_CACHED
+    cursor_ordering = ('id',)
 
     def get_serializer(self, *args, **kwargs):
         if self.action == 'list':
@@ -171,7 +425,22 @@ class SubscribtionViewSet(CreateDestroyViewSet, mixins.ListModelMixin):
         )
 
     def get_queryset(self):
-        return self.request.user.subscriptions.all()
+        return self.request.user.subscriptions.select_related('author')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Подписки с последними рецептами авторов: рецепты всех авторов
+        страницы загружаются одним запросом.
+        """
+        recipes_limit = UserWithRecipeSerializer.get_recipes_limit(request)
+        page = self.paginate_queryset(self.get_queryset())
+        author_recipes = Recipe.objects.latest_by_author(
+            [subscription.author_id for subscription in page], recipes_limit
+        )
+        serializer = SubscribtionSerializer(page, many=True, context={
+            **self.get_serializer_context(), 'author_recipes': author_recipes,
+        })
+        return self.get_paginated_response(serializer.data)
 
     @transaction.atomic
     def delete(self, request, *args, **kwargs):
@@ -181,3 +450,126 @@ class SubscribtionViewSet(CreateDestroyViewSet, mixins.ListModelMixin):
         )
         instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BatchRelationView(APIView):
+    """
+    Базовый класс для массового добавления (POST) и удаления (DELETE) связей
+    текущего пользователя с объектами `target_model` по списку `ids`.
+
+    Существование объектов и текущие связи проверяются двумя запросами,
+    новые связи вставляются одним `bulk_create`, удаляемые — одним DELETE.
+    В ответе — статус для каждого id.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    model = None
+    target_model = None
+    target_field = None
+
+    def get_ids(self, request):
+        ids = request.data.get('ids') if hasattr(request.data, 'get') else None
+        if ids is None and 'ids' in request.query_params:
+            ids = request.query_params['ids'].split(',')
+        try:
+            ids = list(dict.fromkeys(int(value) for value in ids))
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': ErrorMessage.BATCH_IDS})
+        if not ids or len(ids) > BATCH_MAX_SIZE:
+            raise ValidationError({'ids': ErrorMessage.BATCH_IDS})
+        return ids
+
+    def get_related_ids(self, user, ids):
+        return set(self.model.objects.filter(**{
+            'user': user, f'{self.target_field}_id__in': ids,
+        }).values_list(f'{self.target_field}_id', flat=True))
+
+    def forbidden_ids(self, user, ids):
+        return set()
+
+    def create_relations(self, user, ids):
+        """
+        Создает связи одним запросом, пропуская уже существующие, и
+        возвращает id объектов, связи с которыми есть после вставки
+        (повторное чтение одним запросом). Связь, созданная параллельным
+        запросом сразу после чтения `related`, неотличима от новой:
+        такие редкие расхождения счетчиков исправляет reconcile_counters.
+        """
+        self.model.objects.bulk_create((
+            self.model(user=user, **{f'{self.target_field}_id': pk})
+            for pk in ids
+        ), ignore_conflicts=True)
+        created = self.get_related_ids(user, ids)
+        ids = [pk for pk in ids if pk in created]
+        relations_bulk_created(self.model, user.id, ids)
+        return ids
+
+    def response(self, ids, statuses):
+        return Response([
+            {'id': pk, 'status': statuses.get(pk)} for pk in ids
+        ])
+
+    def post(self, request):
+        ids = self.get_ids(request)
+        existing = set(self.target_model.objects.filter(
+            pk__in=ids
+        ).values_list('id', flat=True))
+        forbidden = self.forbidden_ids(request.user, ids)
+        with transaction.atomic():
+            related = self.get_related_ids(request.user, ids)
+            added = [
+                pk for pk in ids
+                if pk in existing and pk not in related | forbidden
+            ]
+            added = self.create_relations(request.user, added)
+        statuses = dict.fromkeys(ids, 'not_found')
+        statuses.update(dict.fromkeys(existing, 'exists'))
+        statuses.update(dict.fromkeys(forbidden, 'forbidden'))
+        statuses.update(dict.fromkeys(added, 'added'))
+        return self.response(ids, statuses)
+
+    def delete(self, request):
+        ids = self.get_ids(request)
+        with transaction.atomic():
+            relations = self.model.objects.filter(**{
+                'user': request.user, f'{self.target_field}_id__in': ids,
+            })
+            removed = list(relations.select_for_update().values_list(
+                f'{self.target_field}_id', flat=True
+            ))
+            relations._raw_delete(relations.db)
+            relations_bulk_deleted(self.model, request.user.id, removed)
+        statuses = dict.fromkeys(ids, 'not_found')
+        statuses.update(dict.fromkeys(removed, 'removed'))
+        return self.response(ids, statuses)
+
+
+class FavoriteBatchView(BatchRelationView):
+    """Массовое добавление и удаление рецептов в Избранном"""
+    model = Favorite
+    target_model = Recipe
+    target_field = 'recipe'
+
+
+class ShoppingCartBatchView(BatchRelationView):
+    """Массовое добавление и удаление рецептов в Списке покупок"""
+    model = ShoppingCart
+    target_model = Recipe
+    target_field = 'recipe'
+
+
+class SubscriptionBatchView(BatchRelationView):
+    """Массовая подписка на авторов и отписка от них"""
+    model = Subscription
+    target_model = User
+    target_field = 'author'
+
+    def forbidden_ids(self, user, ids):
+        return {user.id} & set(ids)
+
+
+class CacheMetricsView(APIView):
+    """Счетчики попаданий и промахов кэшей для администраторов"""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(get_metrics())
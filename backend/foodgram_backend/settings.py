@@ -74,6 +74,39 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех процессов (веб-процессы, обработчик картинок, служебные
+# команды): через него расходятся версии кэшированных данных. В контейнерах
+# используется Memcached; файловый кэш по умолчанию — для локального запуска.
+FILE_CACHE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', FILE_CACHE_BACKEND),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')
+        ),
+    }
+}
+if CACHES['default']['BACKEND'] == FILE_CACHE_BACKEND:
+    # файловый кэш перебирает каталог при каждой записи сверх MAX_ENTRIES
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000)),
+        'CULL_FREQUENCY': 10,
+    }
+
+# Счетчики попаданий в кэш (/api/metrics/). Включаются только для кэша с
+# атомарным incr (Memcached): в файловом кэше это чтение и запись файла на
+# каждый запрос с потерей значений при параллельных запросах.
+CACHE_METRICS = os.getenv('CACHE_METRICS', 'False') == 'True'
+
+# Стратегия ленты подписок: fan_in (соединение с Подписками при чтении) или
+# fan_out (записи ленты создаются при публикации рецепта).
+FEED_STRATEGY = os.getenv('FEED_STRATEGY', 'fan_in')
+
+# Каталог индекса похожих рецептов (строится командой rebuild_similar_index).
+SIMILAR_INDEX_DIR = os.getenv(
+    'SIMILAR_INDEX_DIR', os.path.join(BASE_DIR, 'similar_index')
+)
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -111,6 +144,10 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загруженные файлы больше этого размера записываются во временный файл
+# по частям, а не хранятся в памяти целиком.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 ** 20
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 USE_X_FORWARDED_HOST = True
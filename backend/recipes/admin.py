@@ -51,13 +51,14 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ('name', 'author__username', 'author__email',)
     inlines = (IngredientRecipeInline, TagRecipeInline,)
 
+    @admin.display(description='Добавлений в избранное')
     def added_to_favorites(self, obj) -> int:
-        return obj.favorites.count()
+        return obj.favorites_count
 
     def get_queryset(self, request: HttpRequest) -> QuerySet[Any]:
         queryset = super().get_queryset(request)
-        queryset = queryset.prefetch_related(
-            'favorites', 'author', 'ingredientrecipe', 'tagrecipe_set'
+        queryset = queryset.select_related('author').prefetch_related(
+            'ingredientrecipe', 'tagrecipe_set'
         )
         return queryset
 
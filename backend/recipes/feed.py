@@ -0,0 +1,80 @@
+from django.conf import settings
+
+from api.constants import (
+    FEED_BATCH_SIZE, FEED_STRATEGY_FAN_IN, FEED_STRATEGY_FAN_OUT
+)
+
+
+def fan_out_enabled():
+    return settings.FEED_STRATEGY == FEED_STRATEGY_FAN_OUT
+
+
+def feed_queryset(user, queryset, strategy=None):
+    """
+    Рецепты авторов из Подписок пользователя.
+
+    `fan_in` — соединение с Подписками при чтении,
+    `fan_out` — чтение ленты, записанной при публикации рецептов.
+    """
+    if (strategy or settings.FEED_STRATEGY) == FEED_STRATEGY_FAN_IN:
+        return queryset.filter(author__followers__user=user)
+    return queryset.filter(feed_entries__user=user)
+
+
+def _bulk_create(entries):
+    from recipes.models import FeedEntry
+
+    FeedEntry.objects.bulk_create(
+        entries, batch_size=FEED_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out_recipe(recipe):
+    """Записывает новый рецепт в ленты всех подписчиков автора."""
+    from recipes.models import FeedEntry, Subscription
+
+    _bulk_create(
+        FeedEntry(user_id=user_id, recipe_id=recipe.id)
+        for user_id in Subscription.objects.filter(
+            author_id=recipe.author_id
+        ).values_list('user_id', flat=True).iterator()
+    )
+
+
+def backfill_feed(user_id, *author_ids):
+    """Добавляет в ленту подписчика уже опубликованные рецепты авторов."""
+    from recipes.models import FeedEntry, Recipe
+
+    _bulk_create(
+        FeedEntry(user_id=user_id, recipe_id=recipe_id)
+        for recipe_id in Recipe.objects.filter(
+            author_id__in=author_ids
+        ).values_list('id', flat=True).iterator()
+    )
+
+
+def prune_feed(user_id, *author_ids):
+    """Удаляет рецепты авторов из ленты бывшего подписчика."""
+    from recipes.models import FeedEntry
+
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id__in=author_ids
+    ).delete()
+
+
+def rebuild_feed(user_ids=None):
+    """Пересчитывает ленты пользователей по текущим Подпискам."""
+    from recipes.models import FeedEntry, Subscription
+
+    entries = FeedEntry.objects.all()
+    subscriptions = Subscription.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+    entries.delete()
+    _bulk_create(
+        FeedEntry(user_id=user_id, recipe_id=recipe_id)
+        for user_id, recipe_id in subscriptions.filter(
+            author__recipes__isnull=False
+        ).values_list('user_id', 'author__recipes__id').iterator()
+    )
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    ShoppingListItem.objects.bulk_create((
+        ShoppingListItem(
+            user_id=row['recipe__shopping_cart__user'],
+            ingredient_id=row['ingredient_id'],
+            total_amount=row['total'],
+        )
+        for row in IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False
+        ).values('recipe__shopping_cart__user', 'ingredient_id').order_by(
+        ).annotate(total=Sum('amount')).iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0007_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(help_text='Суммарное количество ингредиента в Списке покупок.', verbose_name='Количество ингредиента')),
+                ('ingredient', models.ForeignKey(help_text='ID ингредиента.', on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(help_text='ID пользователя.', on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент из Списка покупок',
+                'verbose_name_plural': 'Ингредиенты из Списков покупок',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:43
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# дата для уже существующих добавлений: вне окон дня и недели, чтобы
+# первый пересчет не считал всю историю недавней
+BACKFILL_CREATED_AT = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('favorite_id', models.BigIntegerField(default=0, verbose_name='Последнее учтенное добавление в избранное')),
+                ('shopping_cart_id', models.BigIntegerField(default=0, verbose_name='Последнее учтенное добавление в Список покупок')),
+                ('computed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата пересчета')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка рейтинга популярности',
+                'verbose_name_plural': 'Контрольные точки рейтинга популярности',
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=BACKFILL_CREATED_AT, help_text='Дата добавления. Заполняется автоматически.', verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=BACKFILL_CREATED_AT, help_text='Дата добавления. Заполняется автоматически.', verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'За день'), ('week', 'За неделю'), ('all', 'За все время')], help_text='Период, за который рассчитана оценка.', max_length=8, verbose_name='Период')),
+                ('score', models.FloatField(help_text='Оценка популярности с затуханием по времени.', verbose_name='Оценка популярности')),
+                ('recipe', models.ForeignKey(help_text='ID рецепта.', on_delete=django.db.models.deletion.CASCADE, related_name='popularity', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+                'ordering': ('period', '-score', '-recipe_id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipepopularity',
+            index=models.Index(fields=['period', '-score', '-recipe'], name='popularity_period_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipepopularity',
+            constraint=models.UniqueConstraint(fields=('recipe', 'period'), name='unique_recipe_popularity'),
+        ),
+    ]
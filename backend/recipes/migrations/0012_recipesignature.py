@@ -0,0 +1,27 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSignature',
+            fields=[
+                ('recipe', models.OneToOneField(help_text='ID рецепта.', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('signature', models.BinaryField(help_text='MinHash-сигнатура набора ингредиентов рецепта.', verbose_name='Сигнатура')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Сигнатура рецепта',
+                'verbose_name_plural': 'Сигнатуры рецептов',
+                'ordering': ('recipe_id',),
+            },
+        ),
+    ]
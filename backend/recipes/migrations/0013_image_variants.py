@@ -0,0 +1,37 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipesignature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Пути к уменьшенным копиям картинки и их версиям WebP. Заполняется обработчиком картинок.', verbose_name='Варианты картинки'),
+        ),
+        migrations.CreateModel(
+            name='ImageTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.CharField(help_text='Путь к обрабатываемой картинке в хранилище.', max_length=255, verbose_name='Картинка')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Число попыток')),
+                ('run_after', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Время, до которого задача не выполняется.', verbose_name='Не раньше')),
+                ('error', models.TextField(blank=True, help_text='Текст ошибки последней попытки.', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('recipe', models.ForeignKey(help_text='ID рецепта.', on_delete=django.db.models.deletion.CASCADE, related_name='image_tasks', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Задача обработки картинки',
+                'verbose_name_plural': 'Задачи обработки картинок',
+                'ordering': ('id',),
+            },
+        ),
+    ]
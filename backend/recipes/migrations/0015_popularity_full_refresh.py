@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='popularitycheckpoint',
+            name='full_computed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата полного пересчета'),
+        ),
+    ]
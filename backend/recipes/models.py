@@ -1,12 +1,19 @@
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    Exists, F, OuterRef, Prefetch, Sum, Value, Window
+)
+from django.db.models.functions import RowNumber
 from django.db.models.constraints import CheckConstraint, UniqueConstraint
+from django.utils import timezone
 
 from api.constants import (
     MAX_VALUE_AMOUNT, MAX_VALUE_COOKING_TIME, MIN_VALUE_AMOUNT,
     MIN_VALUE_COOKING_TIME
 )
+from api.storage import ContentAddressedStorage
 from api.validators import validate_hex_color
 
 User = settings.AUTH_USER_MODEL
@@ -70,6 +77,84 @@ class Ingredient(models.Model):
         return self.name
 
 
+def recipe_related_lookups():
+    """Связи, которые загружаются при отображении рецептов."""
+    return (
+        'tags',
+        Prefetch(
+            'ingredientrecipe',
+            queryset=IngredientRecipe.objects.select_related('ingredient'),
+        ),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с планом загрузки связанных объектов."""
+
+    def with_related(self):
+        """
+        Загружает автора, теги и ингредиенты рецептов фиксированным числом
+        запросов независимо от количества рецептов.
+        """
+        return self.select_related('author').prefetch_related(
+            *recipe_related_lookups()
+        )
+
+    def with_user_flags(self, user):
+        """
+        Добавляет к рецептам признаки `is_favorited` и `is_in_shopping_cart`
+        коррелированными подзапросами в основном SQL-запросе.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+    def with_author_subscription(self, user):
+        """Добавляет признак `is_subscribed` подписки читателя на автора."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=models.BooleanField())
+            )
+        return self.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(user=user, author=OuterRef('author'))
+        ))
+
+    def latest_by_author(self, author_ids, limit=None):
+        """
+        Последние `limit` рецептов каждого автора одним запросом с оконной
+        функцией ROW_NUMBER() OVER (PARTITION BY author_id).
+        Возвращает словарь {id автора: [рецепты]}.
+        """
+        recipes = {author_id: [] for author_id in author_ids}
+        queryset = self.filter(author_id__in=recipes)
+        if limit is not None:
+            sql, params = queryset.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )).query.sql_with_params()
+            queryset = self.raw(
+                f'SELECT * FROM ({sql}) ranked WHERE ranked.row_number <= %s '
+                f'ORDER BY ranked.pub_date DESC, ranked.id DESC',
+                (*params, limit),
+            )
+        for recipe in queryset:
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
     author = models.ForeignKey(
@@ -96,10 +181,16 @@ class Recipe(models.Model):
         help_text='Список тегов рецепта.',
     )
     image = models.ImageField(
-        upload_to='recipes/images/',
+        upload_to='recipes/images/', storage=ContentAddressedStorage(),
         verbose_name='Картинка',
         help_text='Картинка (при передаче через API закодированная в Base64).',
     )
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False,
+        verbose_name='Варианты картинки',
+        help_text=('Пути к уменьшенным копиям картинки и их версиям WebP. '
+                   'Заполняется обработчиком картинок.'),
+    )
     text = models.TextField(
         verbose_name='Описание',
         help_text='Описание рецепта',
@@ -119,13 +210,41 @@ class Recipe(models.Model):
         verbose_name='Дата добавления рецепта',
         help_text='Дата добавления рецепта. Заполняется автоматически.',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения рецепта',
+        help_text=('Дата последнего изменения рецепта, его ингредиентов или '
+                   'тегов. Заполняется автоматически.'),
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name='Количество добавлений в избранное',
+        help_text='Заполняется автоматически.',
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name='Количество добавлений в списки покупок',
+        help_text='Заполняется автоматически.',
+    )
+    search_vector = SearchVectorField(
+        null=True, editable=False,
+        verbose_name='Поисковый вектор',
+        help_text=('Название, описание и ингредиенты рецепта для '
+                   'полнотекстового поиска. Заполняется автоматически.'),
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-pub_date', )
+        ordering = ('-pub_date', '-id',)
         constraints = (
             UniqueConstraint(fields=('author', 'name',),
                              name='unique_author_recipe'),
         )
+        indexes = (
+            models.Index(fields=('-pub_date', '-id',),
+                         name='recipe_pub_date_id_idx'),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -152,6 +271,10 @@ class TagRecipe(models.Model):
             UniqueConstraint(fields=('recipe', 'tag',),
                              name='unique_recipe_tag'),
         )
+        indexes = (
+            models.Index(fields=('tag', 'recipe',),
+                         name='tagrecipe_tag_recipe_idx'),
+        )
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецептов'
 
@@ -212,6 +335,12 @@ class Favorite(models.Model):
         help_text='ID рецепта.',
     )
 
+    created_at = models.DateTimeField(
+        auto_now_add=True, db_index=True,
+        verbose_name='Дата добавления',
+        help_text='Дата добавления. Заполняется автоматически.',
+    )
+
     class Meta:
         ordering = ('id',)
         constraints = (
@@ -242,6 +371,10 @@ class Subscription(models.Model):
 
     class Meta:
         ordering = ('id',)
+        indexes = (
+            models.Index(fields=('user', 'id'),
+                         name='subscription_user_id_idx'),
+        )
         constraints = (
             UniqueConstraint(fields=('user', 'author',),
                              name='unique_subscription'),
@@ -270,6 +403,12 @@ class ShoppingCart(models.Model):
         help_text='ID рецепта в списке покупок.',
     )
 
+    created_at = models.DateTimeField(
+        auto_now_add=True, db_index=True,
+        verbose_name='Дата добавления',
+        help_text='Дата добавления. Заполняется автоматически.',
+    )
+
     class Meta:
         ordering = ('id',)
         constraints = (
@@ -281,3 +420,314 @@ class ShoppingCart(models.Model):
 
     def __str__(self) -> str:
         return f'{self.user} {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """
+    Модель ленты подписок: рецепт автора, записанный в ленту подписчика
+    при публикации (стратегия ленты `fan_out`).
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+        help_text='ID подписчика.',
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+        help_text='ID рецепта.',
+    )
+
+    class Meta:
+        ordering = ('id',)
+        constraints = (
+            UniqueConstraint(fields=('user', 'recipe',),
+                             name='unique_feed_entry'),
+        )
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.recipe}'
+
+
+class RecipePopularity(models.Model):
+    """
+    Модель рейтинга популярности: оценка рецепта за период по добавлениям
+    в избранное и Списки покупок. Пересчитывается командой
+    `refresh_popularity`.
+    """
+    DAY = 'day'
+    WEEK = 'week'
+    ALL = 'all'
+    PERIODS = (
+        (DAY, 'За день'),
+        (WEEK, 'За неделю'),
+        (ALL, 'За все время'),
+    )
+
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='popularity',
+        verbose_name='Рецепт',
+        help_text='ID рецепта.',
+    )
+    period = models.CharField(
+        max_length=8, choices=PERIODS,
+        verbose_name='Период',
+        help_text='Период, за который рассчитана оценка.',
+    )
+    score = models.FloatField(
+        verbose_name='Оценка популярности',
+        help_text='Оценка популярности с затуханием по времени.',
+    )
+
+    class Meta:
+        ordering = ('period', '-score', '-recipe_id')
+        indexes = (
+            models.Index(fields=('period', '-score', '-recipe'),
+                         name='popularity_period_score_idx'),
+        )
+        constraints = (
+            UniqueConstraint(fields=('recipe', 'period',),
+                             name='unique_recipe_popularity'),
+        )
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+
+    def __str__(self) -> str:
+        return f'{self.recipe} {self.period} {self.score}'
+
+
+class PopularityCheckpoint(models.Model):
+    """
+    Модель контрольной точки пересчета рейтинга популярности: последние
+    учтенные id добавлений в избранное и Списки покупок.
+    """
+    favorite_id = models.BigIntegerField(
+        default=0,
+        verbose_name='Последнее учтенное добавление в избранное',
+    )
+    shopping_cart_id = models.BigIntegerField(
+        default=0,
+        verbose_name='Последнее учтенное добавление в Список покупок',
+    )
+    computed_at = models.DateTimeField(
+        null=True, blank=True,
+        verbose_name='Дата пересчета',
+    )
+    full_computed_at = models.DateTimeField(
+        null=True, blank=True,
+        verbose_name='Дата полного пересчета',
+    )
+
+    class Meta:
+        verbose_name = 'Контрольная точка рейтинга популярности'
+        verbose_name_plural = 'Контрольные точки рейтинга популярности'
+
+    def __str__(self) -> str:
+        return f'{self.computed_at}'
+
+
+class RecipeSignature(models.Model):
+    """
+    Модель MinHash-сигнатуры рецепта, ингредиенты которого изменились после
+    построения индекса похожих рецептов. Сигнатуры дополняют индекс на диске
+    до следующего полного пересчета.
+    """
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, primary_key=True,
+        related_name='signature',
+        verbose_name='Рецепт',
+        help_text='ID рецепта.',
+    )
+    signature = models.BinaryField(
+        verbose_name='Сигнатура',
+        help_text='MinHash-сигнатура набора ингредиентов рецепта.',
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+
+    class Meta:
+        ordering = ('recipe_id',)
+        verbose_name = 'Сигнатура рецепта'
+        verbose_name_plural = 'Сигнатуры рецептов'
+
+    def __str__(self) -> str:
+        return f'{self.recipe}'
+
+
+class ImageTask(models.Model):
+    """
+    Модель задачи очереди обработки картинки рецепта: построения
+    уменьшенных копий и их версий WebP. Выполненные задачи удаляются.
+    """
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='image_tasks',
+        verbose_name='Рецепт',
+        help_text='ID рецепта.',
+    )
+    image = models.CharField(
+        max_length=255,
+        verbose_name='Картинка',
+        help_text='Путь к обрабатываемой картинке в хранилище.',
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Число попыток',
+    )
+    run_after = models.DateTimeField(
+        default=timezone.now, db_index=True,
+        verbose_name='Не раньше',
+        help_text='Время, до которого задача не выполняется.',
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка',
+        help_text='Текст ошибки последней попытки.',
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания',
+    )
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = 'Задача обработки картинки'
+        verbose_name_plural = 'Задачи обработки картинок'
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id} {self.image}'
+
+
+class ShoppingListItemManager(models.Manager):
+    """
+    Менеджер агрегированного Списка покупок: изменения количеств
+    применяются инкрементально при изменении Списков покупок и рецептов.
+    """
+
+    @transaction.atomic
+    def apply_deltas(self, user_ids, deltas):
+        """
+        Прибавляет к количеству ингредиентов `deltas` ({id ингредиента:
+        изменение}) в Списках покупок пользователей `user_ids`.
+        """
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not deltas:
+            return
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        # недостающие строки вставляются с нулевым количеством, пропуская
+        # созданные параллельно, и затем изменяются вместе с остальными
+        self.bulk_create((
+            self.model(
+                user_id=user_id, ingredient_id=ingredient_id, total_amount=0
+            )
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items() if delta > 0
+        ), batch_size=1000, ignore_conflicts=True)
+        items = list(self.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        ))
+        for item in items:
+            item.total_amount = (
+                F('total_amount') + deltas[item.ingredient_id]
+            )
+        self.bulk_update(items, ('total_amount',), batch_size=1000)
+        self.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas,
+            total_amount__lte=0,
+        ).delete()
+
+    def recipe_amounts(self, recipe_ids, sign=1):
+        return {
+            row['ingredient_id']: sign * row['total']
+            for row in IngredientRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values('ingredient_id').order_by().annotate(total=Sum('amount'))
+        }
+
+    def add_recipes(self, user_id, recipe_ids):
+        self.apply_deltas((user_id,), self.recipe_amounts(recipe_ids))
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.apply_deltas((user_id,), self.recipe_amounts(recipe_ids, -1))
+
+    def apply_recipe_change(self, recipe_id, deltas):
+        """Применяет изменение ингредиентов рецепта ко всем его Спискам."""
+        self.apply_deltas(
+            ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+                'user_id', flat=True
+            ),
+            deltas,
+        )
+
+    @transaction.atomic
+    def rebuild(self, user_ids=None):
+        """Пересчитывает Списки покупок пользователей с нуля."""
+        items = self.all()
+        amounts = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False
+        )
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+            amounts = IngredientRecipe.objects.filter(
+                recipe__shopping_cart__user__in=user_ids
+            )
+        items.delete()
+        self.bulk_create((
+            self.model(
+                user_id=row['recipe__shopping_cart__user'],
+                ingredient_id=row['ingredient_id'],
+                total_amount=row['total'],
+            )
+            for row in amounts.values(
+                'recipe__shopping_cart__user', 'ingredient_id'
+            ).order_by().annotate(total=Sum('amount')).iterator()
+        ), batch_size=1000)
+
+
+class ShoppingListItem(models.Model):
+    """
+    Модель агрегированного Списка покупок: суммарное количество ингредиента
+    по всем рецептам из Списка покупок пользователя.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+        help_text='ID пользователя.',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент',
+        help_text='ID ингредиента.',
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Количество ингредиента',
+        help_text='Суммарное количество ингредиента в Списке покупок.',
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        ordering = ('id',)
+        constraints = (
+            UniqueConstraint(fields=('user', 'ingredient',),
+                             name='unique_shopping_list_item'),
+        )
+        verbose_name = 'Ингредиент из Списка покупок'
+        verbose_name_plural = 'Ингредиенты из Списков покупок'
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.ingredient}'
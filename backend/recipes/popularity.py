@@ -0,0 +1,155 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from api.constants import (
+    FEED_BATCH_SIZE, POPULARITY_FAVORITE_WEIGHT,
+    POPULARITY_FULL_REFRESH_INTERVAL, POPULARITY_HALF_LIVES,
+    POPULARITY_MIN_SCORE, POPULARITY_SHOPPING_CART_WEIGHT, POPULARITY_WINDOWS
+)
+
+
+def _decay(seconds, half_life):
+    return 0.5 ** (seconds / half_life)
+
+
+def _chunks(items, size=FEED_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _save_scores(period, scores, relative=True):
+    """
+    Прибавляет `scores` ({id рецепта: оценка}) к оценкам рецептов за
+    период или, если `relative=False`, заменяет ими оценки.
+    """
+    from recipes.models import RecipePopularity
+
+    for recipe_ids in _chunks(scores):
+        existing = {
+            item.recipe_id: item
+            for item in RecipePopularity.objects.filter(
+                period=period, recipe_id__in=recipe_ids
+            )
+        }
+        for recipe_id, item in existing.items():
+            item.score = scores[recipe_id] + (item.score if relative else 0)
+        RecipePopularity.objects.bulk_update(existing.values(), ('score',))
+        RecipePopularity.objects.bulk_create(
+            RecipePopularity(
+                recipe_id=recipe_id, period=period, score=scores[recipe_id]
+            )
+            for recipe_id in recipe_ids if recipe_id not in existing
+        )
+    RecipePopularity.objects.filter(
+        period=period, score__lt=POPULARITY_MIN_SCORE
+    ).delete()
+
+
+def _all_time_scores(sources, full):
+    """
+    Оценки за все время по числу добавлений: для всех рецептов при полном
+    пересчете, иначе — для рецептов, затронутых новыми добавлениями.
+    """
+    scores = defaultdict(float)
+    if full:
+        batches = [None]
+    else:
+        touched = set()
+        for model, last_id, new_id, _ in sources:
+            touched.update(model.objects.filter(
+                id__gt=last_id, id__lte=new_id
+            ).values_list('recipe_id', flat=True))
+        scores.update(dict.fromkeys(touched, 0.0))
+        batches = _chunks(touched)
+    for recipe_ids in batches:
+        for model, _, _, weight in sources:
+            events = model.objects.all()
+            if recipe_ids is not None:
+                events = events.filter(recipe_id__in=recipe_ids)
+            for recipe_id, total in events.values('recipe_id').order_by(
+            ).annotate(total=Count('id')).values_list('recipe_id', 'total'):
+                scores[recipe_id] += total * weight
+    return scores
+
+
+@transaction.atomic
+def refresh_popularity(full=False, now=None):
+    """
+    Пересчитывает рейтинг популярности по добавлениям в избранное и Списки
+    покупок, появившимся после контрольной точки.
+
+    Оценка за день и неделю — сумма весов добавлений в скользящем окне с
+    экспоненциальным затуханием: накопленные оценки умножаются на
+    коэффициент затухания за время с прошлого пересчета, новые добавления
+    прибавляются, вышедшие из окна — вычитаются. Оценка за все время
+    пересчитывается по числу добавлений рецептов, затронутых новыми.
+
+    Удаленные добавления инкрементный пересчет не учитывает, поэтому не
+    реже раза в POPULARITY_FULL_REFRESH_INTERVAL рейтинг пересчитывается
+    с нуля. Возвращает обновленную контрольную точку.
+    """
+    from recipes.models import (
+        Favorite, PopularityCheckpoint, RecipePopularity, ShoppingCart
+    )
+
+    now = now or timezone.now()
+    checkpoint, _ = PopularityCheckpoint.objects.select_for_update(
+    ).get_or_create(pk=1)
+    full = (
+        full or checkpoint.full_computed_at is None
+        or now - checkpoint.full_computed_at
+        >= timedelta(seconds=POPULARITY_FULL_REFRESH_INTERVAL)
+    )
+    if full:
+        RecipePopularity.objects.all().delete()
+        checkpoint.favorite_id = checkpoint.shopping_cart_id = 0
+        checkpoint.computed_at = None
+        checkpoint.full_computed_at = now
+    sources = []
+    for model, field, weight in (
+        (Favorite, 'favorite_id', POPULARITY_FAVORITE_WEIGHT),
+        (ShoppingCart, 'shopping_cart_id', POPULARITY_SHOPPING_CART_WEIGHT),
+    ):
+        last_id = getattr(checkpoint, field)
+        new_id = model.objects.aggregate(last=Max('id'))['last'] or last_id
+        sources.append((model, last_id, new_id, weight))
+        setattr(checkpoint, field, new_id)
+    computed_at = checkpoint.computed_at
+    for period, window in POPULARITY_WINDOWS.items():
+        window = timedelta(seconds=window)
+        half_life = POPULARITY_HALF_LIVES[period]
+        if computed_at is not None:
+            RecipePopularity.objects.filter(period=period).update(
+                score=F('score') * _decay(
+                    (now - computed_at).total_seconds(), half_life
+                )
+            )
+        scores = defaultdict(float)
+        for model, last_id, new_id, weight in sources:
+            events = [(model.objects.filter(
+                id__gt=last_id, id__lte=new_id, created_at__gt=now - window
+            ), weight)]
+            if computed_at is not None:
+                events.append((model.objects.filter(
+                    id__lte=last_id, created_at__gt=computed_at - window,
+                    created_at__lte=now - window,
+                ), -weight))
+            for queryset, event_weight in events:
+                for recipe_id, created_at in queryset.values_list(
+                    'recipe_id', 'created_at'
+                ).iterator():
+                    scores[recipe_id] += event_weight * _decay(
+                        (now - created_at).total_seconds(), half_life
+                    )
+        _save_scores(period, scores)
+    _save_scores(RecipePopularity.ALL, _all_time_scores(
+        sources, full=computed_at is None
+    ), relative=False)
+    checkpoint.computed_at = now
+    checkpoint.save()
+    return checkpoint
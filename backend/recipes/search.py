@@ -0,0 +1,125 @@
+import re
+import threading
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector
+)
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+
+_pending = threading.local()
+
+
+def _match_expression(query):
+    """Запрос FTS5: все слова запроса как экранированные префиксы."""
+    return ' '.join(
+        '"{}"*'.format(word.replace('"', '""'))
+        for word in re.findall(r'\w+', query)
+    )
+
+
+def _update_postgresql(recipe_ids):
+    from django.contrib.postgres.aggregates import StringAgg
+
+    from recipes.models import IngredientRecipe, Recipe
+
+    ingredient_names = Subquery(
+        IngredientRecipe.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    Recipe.objects.filter(pk__in=recipe_ids).update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names, weight='C', config=SEARCH_CONFIG)
+    ))
+
+
+def _update_sqlite(recipe_ids):
+    from recipes.models import IngredientRecipe, Recipe
+
+    names = {}
+    for recipe_id, name in IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient__name'):
+        names.setdefault(recipe_id, []).append(name)
+    rows = [
+        (recipe_id, name, text, ' '.join(names.get(recipe_id, ())))
+        for recipe_id, name, text in Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('id', 'name', 'text')
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(recipe_id,) for recipe_id in recipe_ids],
+        )
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+            f'VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+
+def update_search_index(recipe_ids):
+    """Пересчитывает поисковый индекс рецептов с заданными id."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    if connection.vendor == 'postgresql':
+        _update_postgresql(recipe_ids)
+    elif connection.vendor == 'sqlite':
+        _update_sqlite(recipe_ids)
+
+
+def _flush():
+    recipe_ids = getattr(_pending, 'recipe_ids', set())
+    _pending.recipe_ids = set()
+    update_search_index(recipe_ids)
+
+
+def schedule_search_index_update(*recipe_ids):
+    """
+    Откладывает пересчет индекса до фиксации транзакции: рецепт и все его
+    ингредиенты к этому моменту записаны, а повторные изменения одного
+    рецепта в транзакции приводят к одному пересчету.
+    """
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(_flush)
+
+
+def search_recipes(queryset, query):
+    """
+    Отбирает рецепты, подходящие под поисковый запрос, и сортирует их по
+    убыванию релевантности (аннотация `search_rank`).
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        queryset = queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+    elif connection.vendor == 'sqlite':
+        expression = _match_expression(query)
+        if not expression:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (expression,),
+        )).annotate(search_rank=RawSQL(
+            f'-(SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = {table}.id)',
+            (expression,),
+        ))
+    else:
+        return queryset.filter(name__icontains=query)
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
@@ -10,6 +10,7 @@ User = get_user_model()
 class CustomUserAdmin(UserAdmin):
     list_display = (
         'pk', 'email', 'username', 'first_name', 'last_name', 'password',
+        'recipes_count', 'followers_count',
     )
     list_filter = ('email', 'username',)
     list_editable = ('first_name', 'last_name', 'password',)
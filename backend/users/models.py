@@ -35,6 +35,16 @@ class User(AbstractUser):
         verbose_name='Пароль',
         help_text='Обязательное поле. Не более 150 символов.',
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name='Количество рецептов',
+        help_text='Заполняется автоматически.',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name='Количество подписчиков',
+        help_text='Заполняется автоматически.',
+    )
 
     REQUIRED_FIELDS = ('email', 'first_name', 'last_name',)
 